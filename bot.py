@@ -13,12 +13,29 @@
 """
 
 import os
+import atexit
+import re
+import sys
+import traceback
+import copy
+import queue
+import logging
+import logging.handlers
+import json
+import sqlite3
+import hashlib
 import asyncio
 import random
 import tempfile
-from collections import deque
+import threading
+import itertools
+import weakref
+import concurrent.futures
+from collections import deque, defaultdict, OrderedDict
 from dataclasses import dataclass, field
-from typing import Optional, Deque, Literal, List
+from datetime import timedelta
+from typing import Optional, Deque, Literal, List, Callable, Awaitable, Any
+from urllib.parse import urlparse
 
 import time  # 진행 바용
 import discord
@@ -27,26 +44,119 @@ from discord import app_commands
 from dotenv import load_dotenv
 
 import yt_dlp
-from discord import FFmpegPCMAudio
+from discord import FFmpegPCMAudio, FFmpegOpusAudio
 
 import edge_tts
 
+# =========================
+# 로깅
+# =========================
+# 이벤트 루프에서는 레코드를 큐에 넣기만 하고, 포맷/출력은 백그라운드 스레드가 한다.
+load_dotenv()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json / text
+# event 이름별 샘플링 비율 (N건 중 1건만 기록)
+LOG_SAMPLE_RATES = {"progress_tick": int(os.getenv("LOG_SAMPLE_PROGRESS", "60"))}
+
+_LOG_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        # extra={...} / 길드 컨텍스트 필드
+        for key, value in record.__dict__.items():
+            if key not in _LOG_RECORD_ATTRS:
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """고빈도 이벤트(진행 바 갱신 등)는 N건 중 1건만 통과시킨다. DEBUG 이하에만 적용."""
+
+    def __init__(self, rates: dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self._counts: dict[str, int] = defaultdict(int)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        rate = self.rates.get(event) if event else None
+        if not rate or rate <= 1 or record.levelno > logging.DEBUG:
+            return True
+        self._counts[event] += 1
+        return self._counts[event] % rate == 1
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 메시지/예외만 여기서 문자열로 만들고 나머지 포맷은 리스너 스레드에서
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class GuildLogAdapter(logging.LoggerAdapter):
+    """guild_id 를 모든 레코드에 붙인다 (호출 시 extra 와 병합)."""
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    out = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        out.setFormatter(JsonFormatter())
+    else:
+        out.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers[:] = [handler]
+
+    listener = logging.handlers.QueueListener(log_queue, out, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+log_listener = setup_logging()
+atexit.register(log_listener.stop)  # 종료 시 큐에 남은 로그를 마저 내보낸다
+log = logging.getLogger("enehwl_bot")
+
 from discord import opus
 try:
     if not opus.is_loaded():
         opus.load_opus("opus")  # 같은 폴더의 opus.dll 또는 PATH에서 로드
 except Exception as e:
-    print("Opus 로드 실패:", e)
+    log.warning("Opus 로드 실패: %s", e)
     
 # =========================
 # 환경설정
 # =========================
-load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 
 # ▶ 추가: 시작 시 명령어 초기화 여부 ( .env에 RESET_COMMANDS_ON_START=1 로 켜기 )
 RESET_COMMANDS_ON_START = os.getenv("RESET_COMMANDS_ON_START", "0") in ("1", "true", "True")
 
+TTS_DEFAULT_VOICE = "ko-KR-SunHiNeural"
+SETTINGS_DB = os.getenv("SETTINGS_DB", "settings.db")
+
 INTENTS = discord.Intents.default()
 INTENTS.message_content = True  # /청소 등 로그/메시지 확인 시 필요
 bot = commands.Bot(command_prefix="!", intents=INTENTS)
@@ -67,6 +177,7 @@ FFMPEG_BEFORE = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
 FFMPEG_OPTS = {"before_options": FFMPEG_BEFORE, "options": "-vn"}
 
 LoopMode = Literal["none", "one", "all"]
+QualityMode = Literal["auto", "low", "medium", "high"]
 
 # 트랙 고유 순서 복원을 위한 전역 인덱스
 _GLOBAL_ENQ_ID = 0
@@ -101,26 +212,200 @@ def build_progress_bar(position: float, duration: Optional[float], length: int =
     return "▰" * filled + "▱" * (length - filled)
 
 
-@dataclass
-class Track:
+STREAM_URL_TTL = 3 * 3600  # 서명된 스트림 URL 은 몇 시간 뒤 만료되므로 그 전에 재추출
+
+
+@dataclass(eq=False)
+class TrackMeta:
+    """같은 곡(추출기 + 영상 ID)이 공유하는 메타데이터. track_table 에 하나만 둔다."""
+
+    key: str  # 정규 ID (예: "youtube:dQw4w9WgXcQ")
     title: str
-    stream_url: str  # yt-dlp 추출 URL 또는 로컬 파일 경로(TTS)
     page_url: str
+    stream_url: str = ""  # 비어 있으면 아직 추출 전 (플레이리스트 스텁)
     duration: Optional[float] = None  # 초 단위 (알 수 없으면 None)
+    thumbnail: Optional[str] = None
+    channel: Optional[str] = None
+    http_headers: dict = field(default_factory=dict)
+    alt_urls: List[str] = field(default_factory=list)
+    resolved_at: float = 0.0
+    format: Optional[str] = None  # stream_url 을 뽑을 때 쓴 yt-dlp 포맷 (음질 프로필)
+    # 포맷별로 진행 중인 추출 (같은 곡·같은 포맷 요청은 하나로 합친다)
+    resolve_tasks: dict = field(default_factory=dict, repr=False)
+    # 자동재생용 연관 곡 (key, 제목, 페이지 URL, 길이, 채널) — 한 번 검색하면 재사용
+    related: Optional[List[tuple]] = field(default=None, repr=False)
+
+    def is_fresh(self, fmt: Optional[str] = None) -> bool:
+        """fmt 포맷으로 뽑은 스트림 URL 이 아직 유효한지."""
+        return (
+            bool(self.stream_url)
+            and self.format == fmt
+            and time.monotonic() - self.resolved_at < STREAM_URL_TTL
+        )
+
+    def apply(self, data: dict, fmt: Optional[str] = None):
+        """yt-dlp 추출 결과로 갱신 (같은 곡을 참조하는 모든 대기열 항목에 반영됨)."""
+        self.title = data["title"]
+        self.stream_url = data["url"]
+        self.duration = data["duration"] or self.duration
+        self.thumbnail = data.get("thumbnail") or self.thumbnail
+        self.channel = data.get("uploader") or self.channel
+        self.http_headers = data["http_headers"]
+        self.alt_urls = data["alt_urls"]
+        self.format = fmt
+        self.resolved_at = time.monotonic()
+
+
+@dataclass
+class Track:
+    """대기열 항목. 곡 정보는 공유 TrackMeta 를 참조하고, 요청별 정보만 따로 가진다."""
+
+    meta: TrackMeta
     requester: str = "unknown"
     start_offset: float = 0.0
     enqueue_id: int = field(default_factory=_next_enq_id)
     is_local_file: bool = False
     temp_path: Optional[str] = None
 
-    # ▶ 추가 메타데이터
-    thumbnail: Optional[str] = None
-    channel: Optional[str] = None
+    @property
+    def key(self) -> str:
+        return self.meta.key
+
+    @property
+    def title(self) -> str:
+        return self.meta.title
+
+    @property
+    def page_url(self) -> str:
+        return self.meta.page_url
+
+    @property
+    def stream_url(self) -> str:
+        # yt-dlp 추출 URL 또는 로컬 파일 경로(TTS)
+        return self.meta.stream_url
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.meta.duration
+
+    @property
+    def thumbnail(self) -> Optional[str]:
+        return self.meta.thumbnail
+
+    @property
+    def channel(self) -> Optional[str]:
+        return self.meta.channel
+
+    def needs_resolve(self, fmt: Optional[str] = None) -> bool:
+        # 스텁이거나, 스트림 URL 이 만료됐거나, 다른 음질로 뽑은 URL 이면 재생 직전에 다시 추출한다
+        return not self.is_local_file and not self.meta.is_fresh(fmt)
 
     def display(self) -> str:
         return f"{self.title} (요청: {self.requester})"
 
 
+# 정규 ID -> 공유 메타데이터 (대기열/기록에서 더 참조하지 않으면 자동 해제)
+track_table: "weakref.WeakValueDictionary[str, TrackMeta]" = weakref.WeakValueDictionary()
+
+# 검색어 -> 정규 ID (같은 검색어 재추출 방지)
+_query_keys: "OrderedDict[str, str]" = OrderedDict()
+QUERY_KEY_CACHE_SIZE = 1024
+_YT_ID_RE = re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/)|youtu\.be/)([\w-]{11})")
+
+
+def query_key(query: str) -> Optional[str]:
+    m = _YT_ID_RE.search(query)
+    if m:
+        return f"youtube:{m.group(1)}"
+    key = _query_keys.get(query.strip().lower())
+    if key:
+        _query_keys.move_to_end(query.strip().lower())
+    return key
+
+
+def remember_query(query: str, key: str):
+    _query_keys[query.strip().lower()] = key
+    _query_keys.move_to_end(query.strip().lower())
+    while len(_query_keys) > QUERY_KEY_CACHE_SIZE:
+        _query_keys.popitem(last=False)
+
+
+def intern_meta(key: str, title: str, page_url: str, **kwargs) -> TrackMeta:
+    meta = track_table.get(key)
+    if meta is None:
+        meta = TrackMeta(key=key, title=title, page_url=page_url, **kwargs)
+        track_table[key] = meta
+    return meta
+
+
+class TrackQueue(deque):
+    """변경될 때마다 version 이 올라가는 대기열 (페이지 캐시 무효화용)."""
+
+    def __init__(self, iterable=()):
+        self.version = 0
+        super().__init__(iterable)
+
+    def append(self, x):
+        self.version += 1
+        super().append(x)
+
+    def appendleft(self, x):
+        self.version += 1
+        super().appendleft(x)
+
+    def extend(self, iterable):
+        self.version += 1
+        super().extend(iterable)
+
+    def extendleft(self, iterable):
+        self.version += 1
+        super().extendleft(iterable)
+
+    def insert(self, i, x):
+        self.version += 1
+        super().insert(i, x)
+
+    def pop(self):
+        self.version += 1
+        return super().pop()
+
+    def popleft(self):
+        self.version += 1
+        return super().popleft()
+
+    def remove(self, value):
+        self.version += 1
+        super().remove(value)
+
+    def clear(self):
+        self.version += 1
+        super().clear()
+
+    def rotate(self, n=1):
+        self.version += 1
+        super().rotate(n)
+
+    def reverse(self):
+        self.version += 1
+        super().reverse()
+
+    def __setitem__(self, i, x):
+        self.version += 1
+        super().__setitem__(i, x)
+
+    def __delitem__(self, i):
+        self.version += 1
+        super().__delitem__(i)
+
+    def __iadd__(self, other):
+        self.version += 1
+        return super().__iadd__(other)
+
+    def __imul__(self, n):
+        self.version += 1
+        return super().__imul__(n)
+
+
 players: dict[int, "GuildPlayer"] = {}
 
 
@@ -132,55 +417,917 @@ def get_player(guild: discord.Guild) -> "GuildPlayer":
     return gp
 
 
+# =========================
+# 음질 프로필
+# =========================
+
+@dataclass(frozen=True)
+class QualityProfile:
+    name: str
+    format: str  # yt-dlp 포맷 선택자
+    bitrate: int  # Opus 인코더 비트레이트 (kbps)
+
+
+QUALITY_PROFILES = {
+    "low": QualityProfile("low", "bestaudio[abr<=64]/worstaudio/bestaudio/best", 64),
+    "medium": QualityProfile("medium", "bestaudio[abr<=128][acodec=opus]/bestaudio[abr<=128]/bestaudio/best", 96),
+    "high": QualityProfile("high", YDL_OPTS["format"], 128),
+}
+QUALITY_ORDER = ["low", "medium", "high"]
+
+# 부하 기준: 동시 재생 수 또는 (1분 load average / CPU 수)
+QUALITY_DOWNGRADE_STREAMS = int(os.getenv("QUALITY_DOWNGRADE_STREAMS", "8"))
+QUALITY_DOWNGRADE_LOAD = float(os.getenv("QUALITY_DOWNGRADE_LOAD", "0.8"))
+
+
+def host_load() -> Optional[float]:
+    """1분 load average / CPU 수. 지원하지 않는 OS 면 None."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):  # Windows 등
+        return None
+
+
+def host_under_pressure() -> bool:
+    active = sum(1 for p in players.values() if p.voice and p.voice.is_playing())
+    if active >= QUALITY_DOWNGRADE_STREAMS:
+        return True
+    load = host_load()
+    return load is not None and load >= QUALITY_DOWNGRADE_LOAD
+
+
+# =========================
+# 부하 제어 (과부하 시 새 요청 거절)
+# =========================
+
+ADMIT_MAX_LOOP_LAG = float(os.getenv("ADMIT_MAX_LOOP_LAG", "0.25"))  # 초
+ADMIT_MAX_EXECUTOR_BACKLOG = int(os.getenv("ADMIT_MAX_EXECUTOR_BACKLOG", "16"))
+ADMIT_MAX_FFMPEG = int(os.getenv("ADMIT_MAX_FFMPEG", "24"))
+ADMIT_MAX_LOAD = float(os.getenv("ADMIT_MAX_LOAD", "1.5"))
+ADMIT_DEFER_SEC = 2.0  # 과부하면 이만큼 기다려 보고 그래도 안 되면 거절 (상호작용 응답 전 defer 필요)
+LAG_SAMPLE_INTERVAL = 0.5
+
+AdmissionKind = Literal["join", "play", "tts"]
+
+
+class AdmissionController:
+    """이벤트 루프 지연, 추출 대기열, FFmpeg 수, CPU 부하를 보고 새 작업을 받을지 정한다."""
+
+    def __init__(self):
+        self.loop_lag = 0.0
+        self.executor_pending = 0
+        self.stats: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.shed_reasons: dict[str, int] = defaultdict(int)
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._sample_lag())
+
+    async def _sample_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            lag = max(0.0, loop.time() - t0 - LAG_SAMPLE_INTERVAL)
+            # 급상승은 바로 반영, 회복은 천천히
+            self.loop_lag = lag if lag > self.loop_lag else self.loop_lag * 0.8 + lag * 0.2
+
+    def ffmpeg_count(self) -> int:
+        solo = sum(
+            1 for p in players.values()
+            if p.source is not None and not isinstance(p.source, BroadcastSubscriber)
+        )
+        return solo + len(broadcasts)
+
+    def overload_reason(self, new_session: bool) -> Optional[str]:
+        if self.loop_lag > ADMIT_MAX_LOOP_LAG:
+            return "loop_lag"
+        if self.executor_pending > ADMIT_MAX_EXECUTOR_BACKLOG:
+            return "executor_backlog"
+        if new_session and self.ffmpeg_count() >= ADMIT_MAX_FFMPEG:
+            return "ffmpeg"
+        load = host_load()
+        if load is not None and load > ADMIT_MAX_LOAD:
+            return "cpu"
+        return None
+
+    async def admit(self, kind: AdmissionKind, guild_id: int, new_session: bool = True) -> Optional[str]:
+        """받아들이면 None, 거절하면 사용자에게 보여줄 메시지."""
+        reason = self.overload_reason(new_session)
+        if reason is not None:
+            self.stats[kind]["deferred"] += 1
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + ADMIT_DEFER_SEC
+            while reason is not None and loop.time() < deadline:
+                await asyncio.sleep(0.5)
+                reason = self.overload_reason(new_session)
+
+        if reason is None:
+            self.stats[kind]["admitted"] += 1
+            return None
+
+        self.stats[kind]["rejected"] += 1
+        self.shed_reasons[reason] += 1
+        log.warning(
+            "request shed",
+            extra={"guild_id": guild_id, "kind": kind, "reason": reason, "loop_lag": round(self.loop_lag, 3),
+                   "executor_pending": self.executor_pending},
+        )
+        return f"⚠️ 지금 봇이 과부하 상태라 요청을 처리할 수 없어요 ({SHED_REASON_TEXT[reason]}). 잠시 후 다시 시도해 주세요."
+
+
+SHED_REASON_TEXT = {
+    "loop_lag": "응답 지연",
+    "executor_backlog": "검색 대기열 포화",
+    "ffmpeg": "동시 재생 수 초과",
+    "cpu": "CPU 사용량 높음",
+}
+
+admission = AdmissionController()
+
+
+async def run_blocking(fn, *args):
+    """yt-dlp 처럼 블로킹인 작업을 기본 executor 에서 돌리고, 대기 중인 작업 수를 센다."""
+    admission.executor_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+    finally:
+        admission.executor_pending -= 1
+
+
+def select_quality(player: "GuildPlayer") -> QualityProfile:
+    """길드 설정 → 음성 채널 비트레이트 → 호스트 부하 순으로 프로필을 고른다."""
+    if player.quality != "auto":
+        return QUALITY_PROFILES[player.quality]
+
+    kbps = 64
+    if player.voice and player.voice.channel:
+        kbps = getattr(player.voice.channel, "bitrate", 64000) // 1000
+    if kbps <= 64:
+        idx = 0
+    elif kbps <= 96:
+        idx = 1
+    else:
+        idx = 2
+
+    # 과부하 시 새 스트림은 한 단계 낮춘다
+    if idx > 0 and host_under_pressure():
+        idx -= 1
+    return QUALITY_PROFILES[QUALITY_ORDER[idx]]
+
+
+# =========================
+# 이벤트 루프 감시 / 느린 콜백 프로파일러 (선택)
+# =========================
+
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "0") in ("1", "true", "True")
+WATCHDOG_BEAT = 0.05  # 하트비트 간격
+WATCHDOG_THRESHOLD = float(os.getenv("LOOP_WATCHDOG_THRESHOLD", "0.1"))  # 이보다 오래 막히면 기록
+WATCHDOG_POLL = 0.02
+
+
+@dataclass
+class SlowCallback:
+    name: str  # "함수명 (파일:줄)"
+    count: int = 0
+    total: float = 0.0
+    worst: float = 0.0
+    stack: List[str] = field(default_factory=list)  # 가장 오래 막혔을 때의 스택
+
+
+class LoopWatchdog:
+    """루프 하트비트가 멈추면 별도 스레드에서 루프 스레드의 스택을 떠서 범인을 기록한다."""
+
+    def __init__(self, threshold: float = WATCHDOG_THRESHOLD):
+        self.threshold = threshold
+        self.offenders: dict[str, SlowCallback] = {}
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._last_beat = time.monotonic()
+        self._sample: Optional[List[traceback.FrameSummary]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._sampler, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        log.info("loop watchdog started", extra={"threshold": self.threshold})
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        self.offenders.clear()
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    async def _heartbeat(self):
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(WATCHDOG_BEAT)
+            now = time.monotonic()
+            lag = now - t0 - WATCHDOG_BEAT
+            self._last_beat = now
+            sample, self._sample = self._sample, None
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold and sample:
+                self._record(sample, lag)
+
+    def _sampler(self):
+        while not self._stop.wait(WATCHDOG_POLL):
+            beat = self._last_beat
+            if self._sample is None and time.monotonic() - beat > WATCHDOG_BEAT + self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None and self._last_beat == beat:
+                    self._sample = traceback.extract_stack(frame)
+
+    def _record(self, stack: List[traceback.FrameSummary], lag: float):
+        # 이 파일 안에서 가장 안쪽 프레임을 범인으로 본다 (없으면 맨 안쪽 프레임)
+        culprit = next((f for f in reversed(stack) if f.filename == __file__), stack[-1])
+        name = f"{culprit.name} ({os.path.basename(culprit.filename)}:{culprit.lineno})"
+        entry = self.offenders.setdefault(name, SlowCallback(name))
+        entry.count += 1
+        entry.total += lag
+        if lag >= entry.worst:
+            entry.worst = lag
+            entry.stack = traceback.format_list(stack[-6:])
+        self.stalls += 1
+        log.warning("event loop blocked", extra={"lag": round(lag, 3), "culprit": name})
+
+    def worst_offenders(self, n: int = 5) -> List[SlowCallback]:
+        return sorted(self.offenders.values(), key=lambda e: e.total, reverse=True)[:n]
+
+
+loop_watchdog = LoopWatchdog()
+
+
 # =========================
 # yt-dlp 추출
 # =========================
 
-async def ytdlp_extract(query: str, requester: str) -> Optional[Track]:
-    loop = asyncio.get_running_loop()
-
-    def _extract():
-        with yt_dlp.YoutubeDL(YDL_OPTS) as ydl:
-            info = ydl.extract_info(query, download=False)
-            if "entries" in info:
-                info = info["entries"][0]
-            title = info.get("title", "Unknown")
-            url = info.get("url")
-            page = info.get("webpage_url", query)
-            duration = info.get("duration")
-            http_headers = info.get("http_headers") or {}
-            thumbnail = info.get("thumbnail")
-            uploader = info.get("uploader")
-            return {
-                "title": title,
-                "url": url,
-                "page": page,
-                "duration": duration,
-                "http_headers": http_headers,
-                "thumbnail": thumbnail,
-                "uploader": uploader,
-            }
+def _pick_alt_urls(info: dict) -> List[str]:
+    """선택된 포맷 외의 오디오 포맷 URL (장애 시 대체용, 음질 높은 순)."""
+    chosen = info.get("url")
+    alts = []
+    for f in info.get("formats") or []:
+        url = f.get("url")
+        if not url or url == chosen or f.get("acodec") in (None, "none"):
+            continue
+        if f.get("protocol") not in (None, "http", "https"):
+            continue
+        alts.append((f.get("vcodec") not in (None, "none"), -(f.get("abr") or 0), url))
+    alts.sort()
+    return [url for _, _, url in alts[:4]]
+
+
+def _extract_sync(query: str, fmt: Optional[str] = None) -> dict:
+    opts = YDL_OPTS if not fmt else {**YDL_OPTS, "format": fmt}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(query, download=False)
+        if "entries" in info:
+            info = info["entries"][0]
+        title = info.get("title", "Unknown")
+        url = info.get("url")
+        page = info.get("webpage_url", query)
+        duration = info.get("duration")
+        http_headers = info.get("http_headers") or {}
+        thumbnail = info.get("thumbnail")
+        uploader = info.get("uploader")
+        key = f"{(info.get('extractor_key') or 'generic').lower()}:{info.get('id') or page}"
+        return {
+            "key": key,
+            "title": title,
+            "url": url,
+            "page": page,
+            "duration": duration,
+            "http_headers": http_headers,
+            "thumbnail": thumbnail,
+            "uploader": uploader,
+            "alt_urls": _pick_alt_urls(info),
+        }
+
+
+async def ytdlp_extract(query: str, requester: str, fmt: Optional[str] = None) -> Optional[Track]:
+    # 이미 알고 있는 곡이고 스트림 URL 이 유효하면 추출 생략
+    key = query_key(query)
+    meta = track_table.get(key) if key else None
+    if meta is not None and meta.is_fresh(fmt):
+        return Track(meta=meta, requester=requester)
 
     try:
-        data = await loop.run_in_executor(None, _extract)
+        data = await run_blocking(_extract_sync, query, fmt)
         if not data:
             return None
-        t = Track(
-            title=data["title"],
-            stream_url=data["url"],
-            page_url=data["page"],
-            duration=data["duration"],
-            requester=requester,
-            thumbnail=data.get("thumbnail"),
-            channel=data.get("uploader"),
+        meta = intern_meta(data["key"], data["title"], data["page"])
+        meta.apply(data, fmt)
+        remember_query(query, meta.key)
+        return Track(meta=meta, requester=requester)
+    except Exception:
+        log.exception("yt-dlp extract error", extra={"query": query})
+        return None
+
+
+async def resolve_track(track: Track, fmt: Optional[str] = None, force: bool = False) -> bool:
+    """스텁 트랙의 stream_url 을 채운다. 같은 곡에 대한 동시 추출은 하나로 합친다.
+
+    force=True 면 아직 만료되지 않았어도 다시 추출한다 (재생 중 URL 이 죽었을 때).
+    """
+    if not track.needs_resolve(fmt) and not force:
+        return True
+    meta = track.meta
+    task = meta.resolve_tasks.get(fmt)
+    if task is None:
+        task = meta.resolve_tasks[fmt] = asyncio.ensure_future(run_blocking(_extract_sync, meta.page_url, fmt))
+    try:
+        data = await task
+    except Exception:
+        log.exception("yt-dlp resolve error", extra={"key": meta.key})
+        return False
+    finally:
+        if meta.resolve_tasks.get(fmt) is task:
+            del meta.resolve_tasks[fmt]
+    if force or not meta.is_fresh(fmt):
+        meta.apply(data, fmt)
+        track_table.setdefault(data["key"], meta)
+    return True
+
+
+# =========================
+# 자동재생 (연관 곡 추천)
+# =========================
+
+AUTOPLAY_BUFFER = 2  # 미리 추출해 둘 다음 곡 수
+AUTOPLAY_NO_REPEAT = 20  # 최근 N곡은 다시 고르지 않음
+AUTOPLAY_SEARCH_SIZE = 8
+AUTOPLAY_REQUESTER = "자동재생"
+
+
+def _search_related_sync(query: str, n: int = AUTOPLAY_SEARCH_SIZE) -> List[tuple]:
+    # 목록만 가볍게 가져온다 (스트림 URL 은 재생 전에 따로 추출)
+    opts = {**YDL_OPTS, "extract_flat": "in_playlist", "noplaylist": False}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(f"ytsearch{n}:{query}", download=False)
+    related = []
+    for e in info.get("entries") or []:
+        vid = e.get("id")
+        if not vid:
+            continue
+        related.append(
+            (f"youtube:{vid}", e.get("title") or "Unknown", _YT_WATCH + vid,
+             e.get("duration"), e.get("channel") or e.get("uploader"))
         )
-        # Track에 헤더를 임시로 매달아 FFmpeg로 넘길 수 있게 보관
-        t._http_headers = data["http_headers"]  # type: ignore[attr-defined]
-        return t
-    except Exception as e:
-        print("yt-dlp extract error:", e)
+    return related
+
+
+async def related_metas(meta: TrackMeta) -> List[TrackMeta]:
+    if meta.related is None:
+        query = f"{meta.channel or ''} {meta.title}".strip()
+        meta.related = await run_blocking(_search_related_sync, query)
+    return [
+        intern_meta(key, title, page, duration=duration, channel=channel)
+        for key, title, page, duration, channel in meta.related
+    ]
+
+
+# =========================
+# 플레이리스트 저장/불러오기
+# =========================
+
+PLAYLIST_DIR = os.getenv("PLAYLIST_DIR", "playlists")
+PlaylistScope = Literal["guild", "user"]
+_YT_WATCH = "https://www.youtube.com/watch?v="
+
+
+def _compact_ref(page_url: str) -> str:
+    # 유튜브 링크는 영상 ID만 저장
+    if page_url.startswith(_YT_WATCH):
+        return page_url[len(_YT_WATCH):].split("&", 1)[0]
+    return page_url
+
+
+def _expand_ref(ref: str) -> str:
+    if "://" in ref:
+        return ref
+    return _YT_WATCH + ref
+
+
+def _playlist_path(scope: PlaylistScope, owner_id: int) -> str:
+    return os.path.join(PLAYLIST_DIR, f"{scope}_{owner_id}.json")
+
+
+def load_playlists(scope: PlaylistScope, owner_id: int) -> dict[str, list]:
+    path = _playlist_path(scope, owner_id)
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("playlist file is not an object")
+        return data
+    except FileNotFoundError:
+        return {}
+    except ValueError:  # JSONDecodeError 포함
+        # 깨진 파일은 옆으로 치워 두고 빈 목록으로 시작한다 (다음 저장이 덮어쓰지 않게)
+        log.exception("corrupted playlist file", extra={"path": path})
+        try:
+            os.replace(path, f"{path}.corrupt")
+        except OSError:
+            log.warning("corrupted playlist move failed", exc_info=True, extra={"path": path})
+        return {}
+
+
+def save_playlist(scope: PlaylistScope, owner_id: int, name: str, tracks: List[Track]) -> int:
+    """[ref, 제목, 길이, 채널] 목록으로 저장한다. 스트림 URL 은 만료되므로 저장하지 않는다."""
+    entries = [
+        [_compact_ref(t.page_url), t.title, t.duration, t.channel]
+        for t in tracks
+        if not t.is_local_file
+    ]
+    data = load_playlists(scope, owner_id)
+    data[name] = entries
+    os.makedirs(PLAYLIST_DIR, exist_ok=True)
+    path = _playlist_path(scope, owner_id)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=PLAYLIST_DIR, delete=False) as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(f.name, path)
+    return len(entries)
+
+
+def playlist_stubs(entries: list, requester: str) -> List[Track]:
+    tracks = []
+    for ref, title, duration, channel in entries:
+        key = f"url:{ref}" if "://" in ref else f"youtube:{ref}"
+        meta = intern_meta(key, title, _expand_ref(ref), duration=duration, channel=channel)
+        tracks.append(Track(meta=meta, requester=requester))
+    return tracks
+
+
+# =========================
+# FFmpeg 상태 감시 / 자동 전환
+# =========================
+
+class CountingSource(discord.AudioSource):
+    """보낸 20ms 프레임 수로 재생 위치를 세는 래퍼 (로컬 파일용)."""
+
+    def __init__(self, inner: discord.AudioSource, base_offset: float = 0.0):
+        self.inner = inner
+        self.base_offset = base_offset
+        self.frames = 0
+
+    @property
+    def position(self) -> float:
+        return self.base_offset + self.frames * PCM_FRAME_SEC
+
+    def read(self) -> bytes:
+        data = self.inner.read()
+        if data:
+            self.frames += 1
+        return data
+
+    def is_opus(self) -> bool:
+        return self.inner.is_opus()
+
+    def cleanup(self):
+        self.inner.cleanup()
+
+
+FFMPEG_STALL_TIMEOUT = 8.0  # 이 시간 동안 프레임이 없으면 멈춘 것으로 판단 (reconnect_delay_max 보다 길게)
+FFMPEG_MAX_FAILOVERS = 3
+PCM_FRAME_SEC = 0.02  # FFmpegPCMAudio.read() 1회 = 20ms
+PCM_SILENCE = b"\x00" * discord.opus.Encoder.FRAME_SIZE
+FFMPEG_REEXTRACT_WAIT = 15.0  # 재추출 결과를 무음으로 기다려 주는 최대 시간
+FFMPEG_ERROR_RE = re.compile(
+    r"HTTP error|Server returned|Connection (reset|refused|timed out)|Input/output error"
+    r"|Invalid data found|Error in the pull function|Will reconnect",
+    re.IGNORECASE,
+)
+
+# 호스트별 장애 통계: {"googlevideo.com": {"stalls": 1, ...}}
+source_metrics: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+SOURCE_METRICS_SHOWN = 5  # /부하 에 보여줄 호스트 수
+
+
+def record_source_event(url: str, kind: str):
+    host = urlparse(url).netloc or "local"
+    source_metrics[host][kind] += 1
+
+
+class FFmpegStderrMonitor:
+    """FFmpeg stderr 를 받아 오류 패턴을 센다. (discord.py 가 파이프 스레드에서 write 호출)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.tail: Deque[str] = deque(maxlen=20)
+
+    def write(self, data: bytes):
+        for line in data.decode("utf-8", "replace").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            self.tail.append(line)
+            if FFMPEG_ERROR_RE.search(line):
+                self.errors += 1
+                self.last_error = line
+                record_source_event(self.url, "stderr_errors")
+
+
+class MonitoredSource(discord.AudioSource):
+    """FFmpegPCMAudio 래퍼.
+
+    읽은 바이트/프레임과 stderr 오류를 추적하고, 스트림이 중간에 끊기면
+    대체 포맷(또는 재추출한 URL)으로 현재 위치부터 이어서 재생한다.
+    """
+
+    def __init__(self, player: "GuildPlayer", track: Track):
+        self.player = player
+        self.track = track
+        self.base_offset = track.start_offset or 0.0
+        self.frames = 0
+        self.bytes_read = 0
+        self.failovers = 0
+        self.last_frame_at = time.monotonic()
+        self._alt_urls: List[str] = list(track.meta.alt_urls)
+        self._reextracted = False
+        self._reextract: Optional[concurrent.futures.Future] = None
+        self._waiting_since: Optional[float] = None
+        self.url = track.stream_url  # 지금 재생 중인 URL (자동 전환 시 바뀜)
+        self._inner, self._monitor = self._spawn(self.url, self.base_offset)
+        record_source_event(track.stream_url, "plays")
+
+    @property
+    def position(self) -> float:
+        return self.base_offset + self.frames * PCM_FRAME_SEC
+
+    def _spawn(self, url: str, offset: float):
+        monitor = FFmpegStderrMonitor(url)
+        before = self.player._ffmpeg_before(self.track, offset=offset)
+        source = FFmpegPCMAudio(url, before_options=before, options="-vn", stderr=monitor)
+        return source, monitor
+
+    def touch(self):
+        self.last_frame_at = time.monotonic()
+
+    def is_stalled(self) -> bool:
+        return time.monotonic() - self.last_frame_at > FFMPEG_STALL_TIMEOUT
+
+    def abort_stalled(self):
+        """멈춘 FFmpeg 프로세스를 죽여 read() 가 빠져나오게 한다 (이후 read 에서 전환)."""
+        record_source_event(self._monitor.url, "stalls")
+        proc = getattr(self._inner, "_process", None)
+        try:
+            if proc:
+                proc.kill()
+        except Exception:
+            log.debug("ffmpeg kill failed", exc_info=True)
+        self.player.log.warning("ffmpeg stalled", extra={"url_host": urlparse(self._monitor.url).netloc})
+
+    def _ended_early(self) -> bool:
+        if self._monitor.errors:
+            return True
+        duration = self.track.duration
+        return bool(duration) and self.position < duration - 3
+
+    def _start_reextract(self):
+        """URL 재추출을 이벤트 루프에서 시작한다. 오디오 스레드는 기다리지 않는다."""
+        if self._reextract is not None:
+            return
+        fmt = select_quality(self.player).format
+        self._reextract = asyncio.run_coroutine_threadsafe(
+            resolve_track(self.track, fmt, force=True), bot.loop
+        )
+
+    def _reextract_pending(self) -> bool:
+        return self._reextract is not None and not self._reextract.done()
+
+    def _next_url(self) -> Optional[str]:
+        if self._alt_urls:
+            return self._alt_urls.pop(0)
+        fut = self._reextract
+        if fut is not None and fut.done() and not self._reextracted:
+            # meta 는 루프 쪽 resolve_track 이 갱신했다. 여기서는 읽기만 한다.
+            self._reextracted = True
+            if not fut.cancelled() and fut.exception() is None and fut.result():
+                meta = self.track.meta
+                self._alt_urls = [meta.stream_url, *meta.alt_urls]
+                return self._alt_urls.pop(0)
         return None
 
+    def _failover(self) -> bool:
+        if self._waiting_since is None:
+            record_source_event(self._monitor.url, "failures")
+        while self.failovers < FFMPEG_MAX_FAILOVERS:
+            url = self._next_url()
+            if not url:
+                self._start_reextract()
+                return False
+            self.failovers += 1
+            last_error = self._monitor.last_error  # 새 모니터로 바뀌기 전에 원인을 잡아 둔다
+            self._inner.cleanup()
+            try:
+                self._inner, self._monitor = self._spawn(url, self.position)
+            except discord.ClientException:
+                continue
+            self._waiting_since = None
+            # 대체 URL 은 이 소스에서만 쓴다. 공유 meta 는 meta.format 과 맞는 URL 만 가져야 함
+            self.url = url
+            record_source_event(url, "failovers")
+            self.player.log.warning(
+                "ffmpeg failover",
+                extra={"key": self.track.key, "position": round(self.position, 2), "attempt": self.failovers,
+                       "last_error": last_error},
+            )
+            return True
+        return False
+
+    def read(self) -> bytes:
+        if self._monitor.errors:
+            # 오류가 보이기 시작하면 끊기기 전에 미리 새 URL 을 받아 둔다.
+            self._start_reextract()
+        data = self._inner.read()
+        if not data and self._ended_early():
+            if self._failover():
+                data = self._inner.read()
+            elif self._reextract_pending():
+                # 재추출이 끝날 때까지 무음으로 버틴다 (위치는 그대로).
+                now = time.monotonic()
+                if self._waiting_since is None:
+                    self._waiting_since = now
+                if now - self._waiting_since < FFMPEG_REEXTRACT_WAIT:
+                    self.last_frame_at = now
+                    return PCM_SILENCE
+        if data:
+            self.frames += 1
+            self.bytes_read += len(data)
+            self.last_frame_at = time.monotonic()
+        return data
+
+    def cleanup(self):
+        self._inner.cleanup()
+
+
+# =========================
+# 같이듣기 (한 번 디코딩 → 여러 음성 채널)
+# =========================
+
+OPUS_FRAME_SEC = 0.02  # Opus 프레임 1개 = 20ms
+BROADCAST_MAX_LAG_FRAMES = 250  # 5초 이상 뒤처진 구독자는 라이브 지점으로 점프
+
+
+class BroadcastSession:
+    """FFmpeg/Opus 인코딩 1회분을 여러 VoiceClient 에 나눠 보낸다.
+
+    가장 앞선 구독자가 upstream 에서 프레임을 당겨오고,
+    나머지는 버퍼에 남은 같은 패킷을 읽는다.
+    """
+
+    def __init__(self, key: tuple, upstream: discord.AudioSource, base_offset: float = 0.0):
+        self.key = key
+        self.upstream = upstream
+        self.base_offset = base_offset
+        self.ended = False
+        self._frames: Deque[bytes] = deque()
+        self._first = 0  # _frames[0] 의 프레임 번호
+        self._subs: List["BroadcastSubscriber"] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def head(self) -> int:
+        return self._first + len(self._frames)
+
+    def subscribe(self) -> "BroadcastSubscriber":
+        with self._lock:
+            sub = BroadcastSubscriber(self, self.head)
+            self._subs.append(sub)
+        return sub
+
+    def read_frame(self, sub: "BroadcastSubscriber") -> bytes:
+        with self._lock:
+            idx = max(sub.cursor, self._first)
+            if self.head - idx > BROADCAST_MAX_LAG_FRAMES:
+                idx = self.head
+            if idx == self.head:
+                if self.ended:
+                    return b""
+                data = self.upstream.read()
+                if not data:
+                    self.ended = True
+                    return b""
+                self._frames.append(data)
+            data = self._frames[idx - self._first]
+            sub.cursor = idx + 1
+            self._trim()
+            return data
+
+    def _trim(self):
+        if not self._subs:
+            return
+        # 라이브 지점에서 BROADCAST_MAX_LAG_FRAMES 보다 오래된 프레임은 아무도 읽지 않는다
+        # (read_frame 이 head 로 점프시킴) — 멈춘 구독자가 버퍼를 붙잡지 않게 한다
+        low = max(min(s.cursor for s in self._subs), self.head - BROADCAST_MAX_LAG_FRAMES)
+        while self._frames and self._first < low:
+            self._frames.popleft()
+            self._first += 1
+
+    def unsubscribe(self, sub: "BroadcastSubscriber"):
+        with self._lock:
+            if sub not in self._subs:
+                return
+            self._subs.remove(sub)
+            self._trim()
+            empty = not self._subs
+        if empty:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.ended = True
+        if broadcasts.get(self.key) is self:
+            broadcasts.pop(self.key, None)
+        self.upstream.cleanup()
+
+
+class BroadcastSubscriber(discord.AudioSource):
+    def __init__(self, session: BroadcastSession, cursor: int):
+        self.session = session
+        self.cursor = cursor
+        self.join_frame = cursor
+
+    @property
+    def join_offset(self) -> float:
+        return self.session.base_offset + self.join_frame * OPUS_FRAME_SEC
+
+    @property
+    def position(self) -> float:
+        # 뒤처져서 라이브 지점으로 점프한 경우도 커서 기준이라 정확하다
+        return self.session.base_offset + self.cursor * OPUS_FRAME_SEC
+
+    def read(self) -> bytes:
+        return self.session.read_frame(self)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self.session.unsubscribe(self)
+
+
+# (그룹, 곡 정규 ID) -> 진행 중인 세션
+broadcasts: dict[tuple, BroadcastSession] = {}
+
+
+def join_broadcast(group: str, track: Track, make_upstream) -> BroadcastSubscriber:
+    key = (group, track.key)
+    session = broadcasts.get(key)
+    if session is None or session.ended:
+        session = BroadcastSession(key, make_upstream())
+        broadcasts[key] = session
+    return session.subscribe()
+
+
+# =========================
+# 길드별 설정 (SQLite + 메모리 캐시)
+# =========================
+
+def _parse_bool(raw: str) -> bool:
+    value = raw.strip().lower()
+    if value in ("1", "on", "true", "켜기", "예"):
+        return True
+    if value in ("0", "off", "false", "끄기", "아니오"):
+        return False
+    raise ValueError("on / off 로 입력해 주세요.")
+
+
+def _int_range(lo: int, hi: int) -> Callable[[str], int]:
+    def parse(raw: str) -> int:
+        message = f"{lo} ~ {hi} 사이의 숫자로 입력해 주세요."
+        try:
+            value = int(raw)
+        except ValueError:
+            raise ValueError(message) from None
+        if not lo <= value <= hi:
+            raise ValueError(message)
+        return value
+    return parse
+
+
+def _choice(*choices: str) -> Callable[[str], str]:
+    def parse(raw: str) -> str:
+        value = raw.strip()
+        if value not in choices:
+            raise ValueError(f"{' / '.join(choices)} 중 하나로 입력해 주세요.")
+        return value
+    return parse
+
+
+# edge-tts 목소리 이름 형식 (예: ko-KR-SunHiNeural, zh-CN-liaoning-XiaobeiNeural)
+TTS_VOICE_RE = re.compile(r"^[a-z]{2,3}-[A-Za-z]{2,4}(-[A-Za-z]+)+Neural$")
+
+
+def _parse_voice(raw: str) -> str:
+    value = raw.strip()
+    if not TTS_VOICE_RE.match(value):
+        raise ValueError(f"목소리 이름은 {TTS_DEFAULT_VOICE} 같은 형식으로 입력해 주세요.")
+    return value
+
+
+@dataclass(frozen=True)
+class SettingSpec:
+    default: Any
+    parse: Callable[[str], Any]
+    label: str
+
+
+SETTING_SPECS: dict[str, SettingSpec] = {
+    "tts_voice": SettingSpec(TTS_DEFAULT_VOICE, _parse_voice, "TTS 기본 목소리"),
+    "idle_timeout": SettingSpec(300, _int_range(30, 3600), "대기열이 빈 뒤 자동 퇴장까지 (초)"),
+    "progress_interval": SettingSpec(5, _int_range(2, 60), "진행 바 갱신 간격 (초)"),
+    "quality": SettingSpec("auto", _choice("auto", "low", "medium", "high"), "음질 (auto/low/medium/high)"),
+    "autoplay": SettingSpec(False, _parse_bool, "자동재생 기본값"),
+    "no_duplicates": SettingSpec(False, _parse_bool, "중복 곡 차단"),
+}
+
+
+class GuildSettingsStore:
+    """길드별 설정. 읽기는 메모리 캐시에서, 쓰기는 캐시와 SQLite 에 동시에 (write-through)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._cache: dict[int, dict[str, Any]] = {}
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS guild_settings ("
+                " guild_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (guild_id, key))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _load(self, guild_id: int) -> dict[str, Any]:
+        cached = self._cache.get(guild_id)
+        if cached is None:
+            rows = self._db().execute(
+                "SELECT key, value FROM guild_settings WHERE guild_id = ?", (guild_id,)
+            ).fetchall()
+            cached = {k: json.loads(v) for k, v in rows if k in SETTING_SPECS}
+            self._cache[guild_id] = cached
+        return cached
+
+    def get(self, guild_id: int, key: str) -> Any:
+        return self._load(guild_id).get(key, SETTING_SPECS[key].default)
+
+    def all(self, guild_id: int) -> dict[str, Any]:
+        return {key: self.get(guild_id, key) for key in SETTING_SPECS}
+
+    def set(self, guild_id: int, key: str, value: Any):
+        cached = self._load(guild_id)
+        db = self._db()
+        db.execute(
+            "INSERT OR REPLACE INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?)",
+            (guild_id, key, json.dumps(value, ensure_ascii=False)),
+        )
+        db.commit()
+        cached[key] = value
+
+    def set_raw(self, guild_id: int, key: str, raw: str) -> Any:
+        """사용자 입력을 검증해 저장한다. 잘못된 값이면 ValueError."""
+        value = SETTING_SPECS[key].parse(raw)
+        self.set(guild_id, key, value)
+        return value
+
+    def reset(self, guild_id: int, key: str):
+        cached = self._load(guild_id)
+        db = self._db()
+        db.execute("DELETE FROM guild_settings WHERE guild_id = ? AND key = ?", (guild_id, key))
+        db.commit()
+        cached.pop(key, None)
+
+
+guild_settings = GuildSettingsStore(SETTINGS_DB)
+
 
 # =========================
 # GuildPlayer
@@ -189,8 +1336,9 @@ async def ytdlp_extract(query: str, requester: str) -> Optional[Track]:
 class GuildPlayer:
     def __init__(self, guild: discord.Guild):
         self.guild = guild
+        self.log = GuildLogAdapter(log, {"guild_id": guild.id})
         self.voice: Optional[discord.VoiceClient] = None
-        self.queue: Deque[Track] = deque()
+        self.queue: TrackQueue = TrackQueue()
         self.current: Optional[Track] = None
         self.shuffle: bool = False
         self.loop_mode: LoopMode = "none"
@@ -198,17 +1346,53 @@ class GuildPlayer:
         self.task: Optional[asyncio.Task] = None
         self.play_next = asyncio.Event()
         self.lock = asyncio.Lock()
+        self.broadcast_group: Optional[str] = None  # 같이듣기 그룹 (None 이면 단독 재생)
+
+        # ▶ 자동재생: 대기열이 비면 미리 추출해 둔 연관 곡을 이어서 재생
+        # (설정값이 기본값 — /정지 하면 이번 음성 세션에서만 꺼지고, 새로 입장할 때 다시 읽는다)
+        self.autoplay: bool = self.setting("autoplay")
+        self.autoplay_buffer: Deque[Track] = deque()
+        self.autoplay_task: Optional[asyncio.Task] = None
 
         # ▶ UI 관련 필드
         self.text_channel: Optional[discord.TextChannel] = None
         self.now_playing_message: Optional[discord.Message] = None
         self.progress_task: Optional[asyncio.Task] = None
+        self.health_task: Optional[asyncio.Task] = None
         self.view: Optional["PlayerView"] = None
+        self.np_renderer = NowPlayingRenderer()
+        # 목록 페이지 캐시: kind -> (버전, {페이지: 임베드})
+        self.page_cache: dict[str, tuple[int, dict[int, discord.Embed]]] = {}
 
         # ▶ 재생 위치 추적용
+        # 위치는 오디오 소스가 실제로 보낸 프레임 수로 계산하고,
+        # 벽시계(started_at/paused_at)는 비교(드리프트 측정)용으로만 쓴다
+        self.source: Optional[discord.AudioSource] = None
         self.started_at: Optional[float] = None
         self.paused_at: Optional[float] = None
 
+    # ========= 설정 =========
+
+    def setting(self, key: str) -> Any:
+        return guild_settings.get(self.guild.id, key)
+
+    @property
+    def quality(self) -> QualityMode:
+        return self.setting("quality")
+
+    @quality.setter
+    def quality(self, value: QualityMode):
+        guild_settings.set(self.guild.id, "quality", value)
+
+    @property
+    def no_duplicates(self) -> bool:
+        # 켜면 이미 재생/대기 중인 곡은 다시 넣지 않는다
+        return self.setting("no_duplicates")
+
+    @no_duplicates.setter
+    def no_duplicates(self, value: bool):
+        guild_settings.set(self.guild.id, "no_duplicates", value)
+
     # ========= 재생 위치 관련 =========
 
     def on_start_playback(self):
@@ -226,12 +1410,13 @@ class GuildPlayer:
             self.paused_at = None
 
     def reset_timing(self):
+        self.source = None
         self.started_at = None
         self.paused_at = None
 
-    def get_position(self) -> float:
+    def _wall_position(self) -> Optional[float]:
         if not self.current or self.started_at is None:
-            return 0.0
+            return None
         base = self.current.start_offset or 0.0
         if self.voice and self.voice.is_paused() and self.paused_at is not None:
             elapsed = self.paused_at - self.started_at
@@ -239,16 +1424,36 @@ class GuildPlayer:
             elapsed = time.monotonic() - self.started_at
         return max(0.0, base + elapsed)
 
+    def get_position(self) -> float:
+        if not self.current:
+            return 0.0
+        position = getattr(self.source, "position", None)
+        if position is not None:
+            return position
+        return self._wall_position() or 0.0
+
+    def clock_drift(self) -> Optional[float]:
+        """벽시계 위치 - 프레임 기준 위치 (양수면 오디오가 벽시계보다 늦음)."""
+        wall = self._wall_position()
+        position = getattr(self.source, "position", None)
+        if wall is None or position is None:
+            return None
+        return wall - position
+
     # ========= UI 관련 =========
 
     async def refresh_now_playing_message(self):
         if not self.now_playing_message or not self.current:
             return
-        embed = build_now_playing_embed(self)
+        payload = self.np_renderer.render(self)
+        # 진행도/상태가 그대로면 API 호출 생략 (일시정지 중 틱 등)
+        if payload == self.np_renderer.last_sent:
+            return
         try:
-            await self.now_playing_message.edit(embed=embed, view=self.view)
-        except discord.HTTPException:
-            pass
+            await self.now_playing_message.edit(embed=discord.Embed.from_dict(payload), view=self.view)
+            self.np_renderer.last_sent = payload
+        except discord.HTTPException as e:
+            self.log.warning("now playing edit failed: %s", e)
 
     def _stop_progress_task(self):
         if self.progress_task and not self.progress_task.done():
@@ -258,21 +1463,44 @@ class GuildPlayer:
     async def _progress_loop(self):
         try:
             while True:
-                await asyncio.sleep(5)
+                await asyncio.sleep(self.setting("progress_interval"))
                 if not self.current or not self.voice or not self.now_playing_message:
                     break
                 if not (self.voice.is_playing() or self.voice.is_paused()):
                     break
+                self.log.debug(
+                    "progress tick",
+                    extra={"event": "progress_tick", "position": round(self.get_position(), 2)},
+                )
                 await self.refresh_now_playing_message()
         except asyncio.CancelledError:
             pass
+        except Exception:
+            self.log.exception("progress loop crashed")
+
+    async def _health_loop(self, source: "MonitoredSource"):
+        # 오디오 스레드가 read() 에서 멈춰 있으면 FFmpeg 를 끊어 자동 전환을 유도한다
+        # (구간이동/한곡 반복은 같은 Track 을 다시 쓰므로 소스 기준으로 판단)
+        try:
+            while self.source is source and self.voice:
+                await asyncio.sleep(1)
+                if not self.voice.is_playing() or not self.voice.is_connected():
+                    # 일시정지 중이거나 음성 재연결을 기다리는 동안에는 read 가 호출되지 않음
+                    source.touch()
+                    continue
+                if source.is_stalled():
+                    source.abort_stalled()
+                    source.touch()
+        except asyncio.CancelledError:
+            pass
 
     async def _start_now_playing_ui(self):
         if not self.text_channel or not self.current:
             return
 
         self.view = PlayerView(self)
-        embed = build_now_playing_embed(self)
+        payload = self.np_renderer.render(self)
+        embed = discord.Embed.from_dict(payload)
 
         if self.now_playing_message:
             try:
@@ -290,6 +1518,7 @@ class GuildPlayer:
                 embed=embed,
                 view=self.view,
             )
+        self.np_renderer.last_sent = payload
 
         self._stop_progress_task()
         self.progress_task = asyncio.create_task(self._progress_loop())
@@ -303,30 +1532,72 @@ class GuildPlayer:
             await self.voice.move_to(channel)
         else:
             self.voice = await channel.connect()
+            # 새 음성 세션: /정지 로 꺼 둔 자동재생을 서버 설정값으로 되돌린다
+            self.autoplay = self.setting("autoplay")
 
-    def _build_source(self, track: Track) -> FFmpegPCMAudio:
+    def _ffmpeg_before(self, track: Track, offset: Optional[float] = None) -> str:
         before = FFMPEG_BEFORE
-        if getattr(track, "_http_headers", None):
-            header_lines = "".join(f"{k}: {v}\r\n" for k, v in track._http_headers.items())
+        if track.meta.http_headers:
+            header_lines = "".join(f"{k}: {v}\r\n" for k, v in track.meta.http_headers.items())
             before = f'{before} -headers "{header_lines}"'
-        if track.start_offset and track.start_offset > 0:
-            before = f"-ss {track.start_offset} {before}"
-        return FFmpegPCMAudio(track.stream_url, before_options=before, options="-vn")
+        if offset is None:
+            offset = track.start_offset
+        if offset and offset > 0:
+            before = f"-ss {offset} {before}"
+        return before
+
+    def _build_source(self, track: Track, profile: QualityProfile) -> discord.AudioSource:
+        before = self._ffmpeg_before(track)
+        # ▶ 같이듣기: 처음부터 재생하는 스트리밍 곡만 공유 세션에 붙는다 (구간이동/TTS 제외)
+        if self.broadcast_group and not track.is_local_file and not track.start_offset:
+            sub = join_broadcast(
+                self.broadcast_group,
+                track,
+                lambda: FFmpegOpusAudio(
+                    track.stream_url, bitrate=profile.bitrate, before_options=before, options="-vn"
+                ),
+            )
+            track.start_offset = sub.join_offset
+            return sub
+        if track.is_local_file:
+            source = FFmpegPCMAudio(track.stream_url, before_options=before, options="-vn")
+            return CountingSource(source, track.start_offset or 0.0)
+        return MonitoredSource(self, track)
     
+    def _voice_connected(self) -> bool:
+        return bool(self.voice and self.voice.is_connected())
+
+    def _has_listeners(self) -> bool:
+        channel = self.voice.channel if self.voice else None
+        return bool(channel and any(not m.bot for m in channel.members))
+
+    def _stop_loop(self):
+        # 음성 연결이 없으면 루프를 끝낸다 (다음 요청 때 ensure_task 로 다시 시작)
+        self.autoplay_buffer.clear()
+        self._stop_progress_task()
+        self.reset_timing()
+
     async def player_loop(self):
         while True:
             self.play_next.clear()
 
+            if not self._voice_connected():
+                return self._stop_loop()
+
+            # 채널에 사람이 없으면 자동재생하지 않고 아래 유휴 타이머로 퇴장
+            if not self.queue and self.autoplay and self._has_listeners() and await self._take_autoplay():
+                continue
+
             if not self.queue:
                 try:
-                    await asyncio.wait_for(self.play_next.wait(), timeout=300)
+                    await asyncio.wait_for(self.play_next.wait(), timeout=self.setting("idle_timeout"))
                     continue
                 except asyncio.TimeoutError:
                     try:
                         if self.voice and self.voice.is_connected():
                             await self.voice.disconnect(force=False)
                     except Exception:
-                        pass
+                        self.log.warning("idle disconnect failed", exc_info=True)
                     self._stop_progress_task()
                     self.reset_timing()
                     return
@@ -335,14 +1606,28 @@ class GuildPlayer:
             track = self.current
             track.start_offset = track.start_offset or 0.0
 
-            source = self._build_source(track)
-
-            def after_playback(_err):
+            profile = select_quality(self)
+            if track.needs_resolve(profile.format) and not await resolve_track(track, profile.format):
+                self.current = None
+                continue
+            if not self._voice_connected():
+                # 추출하는 사이 연결이 끊겼으면 곡을 되돌려 놓고 종료
+                self.queue.appendleft(track)
+                self.current = None
+                return self._stop_loop()
+            source = self._build_source(track, profile)
+
+            def after_playback(err):
+                health_task = self.health_task
+                if health_task:
+                    bot.loop.call_soon_threadsafe(health_task.cancel)
+                if err:
+                    self.log.error("playback error", exc_info=err, extra={"key": track.key})
                 if track.is_local_file and track.temp_path:
                     try:
                         os.remove(track.temp_path)
-                    except Exception:
-                        pass
+                    except OSError:
+                        self.log.warning("temp file remove failed", exc_info=True, extra={"path": track.temp_path})
 
                 if self.loop_mode == "one":
                     track.start_offset = 0.0
@@ -350,7 +1635,8 @@ class GuildPlayer:
                 elif self.loop_mode == "all":
                     track.start_offset = 0.0
                     self.queue.append(track)
-                else:
+                elif not track.is_local_file:
+                    # TTS 등 로컬 파일은 다시 재생할 수 없으므로 기록에 남기지 않는다
                     self.history.append(track)
 
                 self.current = None
@@ -358,39 +1644,112 @@ class GuildPlayer:
                 bot.loop.call_soon_threadsafe(self.play_next.set)
 
             try:
-                if not self.voice or not self.voice.is_connected():
-                    self.current = None
-                    self.reset_timing()
-                    continue
-
-                self.voice.play(source, after=after_playback)
+                self.voice.play(source, after=after_playback, bitrate=profile.bitrate)
+                self.source = source
                 self.on_start_playback()
+                if isinstance(source, MonitoredSource):
+                    self.health_task = asyncio.create_task(self._health_loop(source))
+                self.prefetch_next(profile)
+                if not self.queue:
+                    # 마지막 곡 재생 중에 다음 자동재생 곡을 미리 준비
+                    self.schedule_autoplay_fill()
                 await self._start_now_playing_ui()
 
             except Exception:
+                self.log.exception("failed to start playback", extra={"key": track.key})
+                if self.source is not source:
+                    source.cleanup()
                 self.current = None
                 self.reset_timing()
                 self.play_next.set()
 
             await self.play_next.wait()
 
+    def prefetch_next(self, profile: Optional[QualityProfile] = None):
+        # 다음 곡이 스텁이면 지금 재생 중에 미리 추출해 둔다
+        fmt = (profile or select_quality(self)).format
+        if self.queue and self.queue[0].needs_resolve(fmt):
+            asyncio.create_task(resolve_track(self.queue[0], fmt))
+
+    # ========== 자동재생 ==========
+
+    def schedule_autoplay_fill(self):
+        if not self.autoplay or len(self.autoplay_buffer) >= AUTOPLAY_BUFFER:
+            return
+        if self.autoplay_task is None or self.autoplay_task.done():
+            self.autoplay_task = asyncio.create_task(self._fill_autoplay())
+
+    async def _fill_autoplay(self):
+        seed = self.current if self.current and not self.current.is_local_file else None
+        seed = seed or (self.history[-1] if self.history else None)
+        if seed is None:
+            return
+        exclude = {t.key for t in self.history[-AUTOPLAY_NO_REPEAT:]}
+        exclude.update(t.key for t in self.autoplay_buffer)
+        exclude.update(t.key for t in self.queue)
+        if self.current:
+            exclude.add(self.current.key)
+
+        try:
+            pool = [m for m in await related_metas(seed.meta) if m.key not in exclude]
+        except Exception:
+            self.log.warning("autoplay related search failed", exc_info=True, extra={"key": seed.key})
+            pool = []
+        # 연관 곡이 부족하면 이 서버의 재생 기록에서 고른다
+        if len(pool) < AUTOPLAY_BUFFER:
+            seen = set(exclude) | {m.key for m in pool}
+            extra = []
+            for t in self.history:
+                if t.key not in seen:
+                    seen.add(t.key)
+                    extra.append(t.meta)
+            random.shuffle(extra)
+            pool.extend(extra)
+
+        fmt = select_quality(self).format
+        for meta in pool:
+            if not self.autoplay or len(self.autoplay_buffer) >= AUTOPLAY_BUFFER:
+                break
+            track = Track(meta=meta, requester=AUTOPLAY_REQUESTER)
+            if await resolve_track(track, fmt):
+                self.autoplay_buffer.append(track)
+
+    async def _take_autoplay(self) -> bool:
+        if not self.autoplay_buffer:
+            # 준비가 안 됐으면 (예: 자동재생을 막 켠 경우) 채워질 때까지 잠시 기다린다
+            self.schedule_autoplay_fill()
+            if self.autoplay_task:
+                try:
+                    await asyncio.wait_for(asyncio.shield(self.autoplay_task), timeout=30)
+                except asyncio.TimeoutError:
+                    self.log.info("autoplay buffer not ready in time")
+                except Exception:
+                    self.log.warning("autoplay fill failed", exc_info=True)
+        if not self.autoplay or not self.autoplay_buffer:
+            return False
+        self.queue.append(self.autoplay_buffer.popleft())
+        return True
+
     # ========== 유틸 ==========
 
     def toggle_shuffle(self) -> bool:
         self.shuffle = not self.shuffle
+        qlist = list(self.queue)
         if self.shuffle:
-            qlist = list(self.queue)
             random.shuffle(qlist)
-            self.queue = deque(qlist)
         else:
-            qlist = sorted(list(self.queue), key=lambda t: t.enqueue_id)
-            self.queue = deque(qlist)
+            qlist.sort(key=lambda t: t.enqueue_id)
+        self.queue.clear()
+        self.queue.extend(qlist)
         return self.shuffle
 
     def set_loop_mode(self, mode: LoopMode):
         self.loop_mode = mode
 
     def clear(self):
+        # 정지하면 자동재생도 끈다 (안 그러면 곧바로 다음 추천 곡이 재생됨)
+        self.autoplay = False
+        self.autoplay_buffer.clear()
         if self.voice and (self.voice.is_playing() or self.voice.is_paused()):
             self.voice.stop()
         while self.queue:
@@ -398,12 +1757,19 @@ class GuildPlayer:
             if t.is_local_file and t.temp_path:
                 try:
                     os.remove(t.temp_path)
-                except Exception:
-                    pass
+                except OSError:
+                    self.log.warning("temp file remove failed", exc_info=True, extra={"path": t.temp_path})
         self.current = None
         self._stop_progress_task()
         self.reset_timing()
 
+    def is_duplicate(self, key: str) -> bool:
+        if not self.no_duplicates:
+            return False
+        if self.current and self.current.key == key:
+            return True
+        return any(t.key == key for t in self.queue)
+
     def enqueue(self, track: Track):
         self.queue.append(track)
 
@@ -415,54 +1781,64 @@ class GuildPlayer:
 # 임베드 / View 빌더
 # =========================
 
-def build_now_playing_embed(player: GuildPlayer) -> discord.Embed:
-    track = player.current
-    if not track:
-        return discord.Embed(
-            title="지금 재생 중인 곡이 없습니다.",
-            color=discord.Color.dark_grey()
-        )
-
-    position = player.get_position()
-    duration = track.duration
-    bar = build_progress_bar(position, duration)
-    is_paused = bool(player.voice and player.voice.is_paused())
-    queue_len = len(player.queue)
-
-    embed = discord.Embed(
-        title="지금 재생 중 🎧" + (" (일시정지)" if is_paused else ""),
-        description=f"[{track.title}]({track.page_url})",
-        color=discord.Color.blurple(),
-    )
+class NowPlayingRenderer:
+    """지금 재생 중 임베드 렌더러.
 
-    if track.thumbnail:
-        embed.set_thumbnail(url=track.thumbnail)
+    트랙이 바뀔 때만 정적 부분(설명/썸네일/채널/길이/요청자)을 만들고,
+    매 틱에는 진행도/일시정지/푸터만 갈아끼운다.
+    """
 
-    embed.add_field(
-        name="채널",
-        value=track.channel or "정보 없음",
-        inline=True,
-    )
-    embed.add_field(
-        name="길이",
-        value=format_duration(duration),
-        inline=True,
-    )
-    embed.add_field(
-        name="요청자",
-        value=track.requester,
-        inline=True,
-    )
+    def __init__(self):
+        self._track: Optional[Track] = None
+        self._static: dict = {}
+        self._duration_text: str = ""
+        self.last_sent: Optional[dict] = None  # 마지막으로 메시지에 반영한 payload
 
-    embed.add_field(
-        name="진행도",
-        value=f"`{format_duration(position)} / {format_duration(duration)}`\n{bar}",
-        inline=False,
-    )
+    def _prepare(self, track: Track):
+        if self._track is track:
+            return
+        self._track = track
+        self._duration_text = format_duration(track.duration)
+        static = {
+            "type": "rich",
+            "description": f"[{track.title}]({track.page_url})",
+            "color": discord.Color.blurple().value,
+            "fields": [
+                {"name": "채널", "value": track.channel or "정보 없음", "inline": True},
+                {"name": "길이", "value": self._duration_text, "inline": True},
+                {"name": "요청자", "value": track.requester, "inline": True},
+            ],
+        }
+        if track.thumbnail:
+            static["thumbnail"] = {"url": track.thumbnail}
+        self._static = static
+
+    def render(self, player: "GuildPlayer") -> dict:
+        track = player.current
+        if not track:
+            return {
+                "type": "rich",
+                "title": "지금 재생 중인 곡이 없습니다.",
+                "color": discord.Color.dark_grey().value,
+            }
 
-    status = f"셔플: {'ON' if player.shuffle else 'OFF'} / 반복: {player.loop_mode}"
-    embed.set_footer(text=f"대기열 {queue_len}곡 • {status}")
-    return embed
+        self._prepare(track)
+        position = player.get_position()
+        bar = build_progress_bar(position, track.duration)
+        is_paused = bool(player.voice and player.voice.is_paused())
+        status = f"셔플: {'ON' if player.shuffle else 'OFF'} / 반복: {player.loop_mode}"
+
+        payload = dict(self._static)
+        payload["title"] = "지금 재생 중 🎧" + (" (일시정지)" if is_paused else "")
+        payload["fields"] = self._static["fields"] + [
+            {
+                "name": "진행도",
+                "value": f"`{format_duration(position)} / {self._duration_text}`\n{bar}",
+                "inline": False,
+            }
+        ]
+        payload["footer"] = {"text": f"대기열 {len(player.queue)}곡 • {status}"}
+        return payload
 
 
 def build_added_to_queue_embed(track: Track, position: int) -> discord.Embed:
@@ -495,8 +1871,9 @@ class PlayerView(discord.ui.View):
         self.player = player
 
     async def _update_interaction_message(self, interaction: discord.Interaction):
-        embed = build_now_playing_embed(self.player)
-        await interaction.response.edit_message(embed=embed, view=self)
+        payload = self.player.np_renderer.render(self.player)
+        await interaction.response.edit_message(embed=discord.Embed.from_dict(payload), view=self)
+        self.player.np_renderer.last_sent = payload
 
     @discord.ui.button(emoji="⏯", label="재생 / 일시정지", style=discord.ButtonStyle.secondary)
     async def pause_resume(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -530,7 +1907,7 @@ class PlayerView(discord.ui.View):
             try:
                 await self.player.voice.disconnect()
             except Exception:
-                pass
+                self.player.log.warning("disconnect failed", exc_info=True)
 
         for child in self.children:
             if isinstance(child, discord.ui.Button):
@@ -559,49 +1936,18 @@ class PlayerView(discord.ui.View):
 
     @discord.ui.button(emoji="📃", label="재생목록", style=discord.ButtonStyle.secondary)
     async def show_queue(self, interaction: discord.Interaction, button: discord.ui.Button):
-        q = list(self.player.queue)
-        if not q:
-            desc = "현재 대기열이 비어있어요."
-        else:
-            lines = []
-            for i, t in enumerate(q[:10], start=1):
-                lines.append(
-                    f"`{i:02d}.` [{t.title}]({t.page_url}) — {format_duration(t.duration)} / 요청자: {t.requester}"
-                )
-            if len(q) > 10:
-                lines.append(f"... 외 {len(q) - 10}곡")
-            desc = "\n".join(lines)
-
-        embed = discord.Embed(
-            title="대기열 📃",
-            description=desc,
-            color=discord.Color.dark_teal(),
-        )
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        view = TrackPageView(self.player, "queue")
+        await interaction.response.send_message(embed=view.render(), view=view, ephemeral=True)
 
     @discord.ui.button(emoji="🕒", label="최근", style=discord.ButtonStyle.secondary)
     async def recent(self, interaction: discord.Interaction, button: discord.ui.Button):
-        history_tracks = [t for t in self.player.history if not t.is_local_file]
-        if not history_tracks:
+        if not self.player.history:
             return await interaction.response.send_message("최근에 재생한 곡이 없습니다.", ephemeral=True)
 
-        last_tracks = history_tracks[-10:][::-1]
-        view = RecentView(self.player, last_tracks)
-
-        lines = []
-        for i, t in enumerate(last_tracks, start=1):
-            lines.append(f"`{i}.` {t.title} — {format_duration(t.duration)}")
-        desc = "\n".join(lines)
-
-        embed = discord.Embed(
-            title="최근 재생한 노래",
-            description=desc,
-            color=discord.Color.dark_gold(),
-        )
-
+        view = TrackPageView(self.player, "history")
         await interaction.response.send_message(
             content="🎶 음악을 재생하려면 아래에서 선택하세요.",
-            embed=embed,
+            embed=view.render(),
             view=view,
             ephemeral=True,
         )
@@ -639,20 +1985,17 @@ class RecentSelect(discord.ui.Select):
     async def callback(self, interaction: discord.Interaction):
         idx = int(self.values[0])
         base = self.tracks[idx]
+        if self.player.is_duplicate(base.key):
+            return await interaction.response.send_message("이미 대기열에 있는 곡이에요.", ephemeral=True)
 
         # ▶ 추가: 현재 재생 중인지 여부 확인
         was_idle = self.player.current is None
 
         new_track = Track(
-            title=base.title,
-            stream_url=base.stream_url,
-            page_url=base.page_url,
-            duration=base.duration,
+            meta=base.meta,
             requester=interaction.user.display_name,
             is_local_file=base.is_local_file,
             temp_path=base.temp_path,
-            thumbnail=base.thumbnail,
-            channel=base.channel,
         )
 
         self.player.enqueue(new_track)
@@ -671,10 +2014,106 @@ class RecentSelect(discord.ui.Select):
         )
 
 
-class RecentView(discord.ui.View):
-    def __init__(self, player: GuildPlayer, tracks: List[Track]):
-        super().__init__(timeout=60)
-        self.add_item(RecentSelect(player, tracks))
+PageKind = Literal["queue", "history"]
+PAGE_SIZE = 10
+
+
+def page_slice(player: GuildPlayer, kind: PageKind, page: int) -> List[Track]:
+    """전체 복사 없이 해당 페이지 구간만 읽는다. (기록은 최신순)"""
+    start = page * PAGE_SIZE
+    if kind == "queue":
+        return list(itertools.islice(player.queue, start, start + PAGE_SIZE))
+    h = player.history
+    end = max(0, len(h) - start)
+    return h[max(0, end - PAGE_SIZE):end][::-1]
+
+
+def page_version(player: GuildPlayer, kind: PageKind) -> int:
+    # 기록은 append 만 되므로 길이가 곧 버전
+    return player.queue.version if kind == "queue" else len(player.history)
+
+
+def build_track_page_embed(player: GuildPlayer, kind: PageKind, page: int) -> discord.Embed:
+    version = page_version(player, kind)
+    cached_version, pages = player.page_cache.get(kind, (-1, {}))
+    if cached_version != version:
+        pages = {}
+        player.page_cache[kind] = (version, pages)
+    if page in pages:
+        return pages[page]
+
+    total = len(player.queue) if kind == "queue" else len(player.history)
+    tracks = page_slice(player, kind, page)
+    start = page * PAGE_SIZE
+    lines = []
+    for i, t in enumerate(tracks, start=start + 1):
+        title = t.title[:80]
+        if kind == "queue":
+            lines.append(
+                f"`{i:02d}.` [{title}]({t.page_url}) — {format_duration(t.duration)} / 요청자: {t.requester}"
+            )
+        else:
+            lines.append(f"`{i}.` {title} — {format_duration(t.duration)}")
+
+    if kind == "queue":
+        embed = discord.Embed(
+            title="대기열 📃",
+            description="\n".join(lines) or "현재 대기열이 비어있어요.",
+            color=discord.Color.dark_teal(),
+        )
+    else:
+        embed = discord.Embed(
+            title="최근 재생한 노래",
+            description="\n".join(lines) or "최근에 재생한 곡이 없습니다.",
+            color=discord.Color.dark_gold(),
+        )
+    embed.set_footer(text=f"{page + 1} / {page_count(total)} 페이지 • 총 {total}곡")
+    pages[page] = embed
+    return embed
+
+
+def page_count(total: int) -> int:
+    return max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+
+
+class TrackPageView(discord.ui.View):
+    """대기열/최근 기록을 페이지 단위로 보여주고, 같은 메시지를 수정하며 넘긴다."""
+
+    def __init__(self, player: GuildPlayer, kind: PageKind):
+        super().__init__(timeout=180)
+        self.player = player
+        self.kind = kind
+        self.page = 0
+        self.select: Optional[RecentSelect] = None
+
+    def _total(self) -> int:
+        return len(self.player.queue) if self.kind == "queue" else len(self.player.history)
+
+    def render(self) -> discord.Embed:
+        self.page = max(0, min(self.page, page_count(self._total()) - 1))
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= page_count(self._total()) - 1
+
+        # 최근 기록은 현재 페이지 곡을 바로 다시 재생할 수 있게 선택 메뉴를 붙인다
+        if self.kind == "history":
+            if self.select:
+                self.remove_item(self.select)
+                self.select = None
+            tracks = page_slice(self.player, "history", self.page)
+            if tracks:
+                self.select = RecentSelect(self.player, tracks)
+                self.add_item(self.select)
+        return build_track_page_embed(self.player, self.kind, self.page)
+
+    @discord.ui.button(emoji="◀", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(emoji="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
 
 
 class AddMusicModal(discord.ui.Modal, title="음악 추가하기"):
@@ -697,9 +2136,15 @@ class AddMusicModal(discord.ui.Modal, title="음악 추가하기"):
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True, thinking=True)
 
-        track = await ytdlp_extract(self.query.value, requester=self.user.display_name)
+        track = await ytdlp_extract(
+            self.query.value,
+            requester=self.user.display_name,
+            fmt=select_quality(self.player).format,
+        )
         if not track:
             return await interaction.followup.send("트랙을 찾지 못했어요.", ephemeral=True)
+        if self.player.is_duplicate(track.key):
+            return await interaction.followup.send("이미 대기열에 있는 곡이에요.", ephemeral=True)
 
         # ▶ 추가: 현재 재생 여부 확인
         was_idle = self.player.current is None
@@ -729,11 +2174,11 @@ async def wipe_all_app_commands():
         for g in bot.guilds:
             try:
                 await bot.http.bulk_upsert_guild_commands(app_id, g.id, [])
-            except Exception as ge:
-                print(f"[경고] 길드({g.id}) 명령어 초기화 실패:", ge)
-        print("✅ 모든 전역/길드 Slash 명령어 초기화 완료")
-    except Exception as e:
-        print("명령어 초기화 중 오류:", e)
+            except Exception:
+                log.warning("길드 명령어 초기화 실패", exc_info=True, extra={"guild_id": g.id})
+        log.info("모든 전역/길드 Slash 명령어 초기화 완료")
+    except Exception:
+        log.exception("명령어 초기화 중 오류")
 
 
 # =========================
@@ -748,10 +2193,14 @@ async def on_ready():
 
     try:
         synced = await bot.tree.sync()
-        print(f"Slash commands synced: {len(synced)}")
-    except Exception as e:
-        print("Sync error:", e)
-    print(f"Logged in as {bot.user} ({bot.user.id})")
+        log.info("Slash commands synced: %d", len(synced))
+    except Exception:
+        log.exception("Sync error")
+    log.info("Logged in as %s (%s)", bot.user, bot.user.id)
+    phrase_bank.start()
+    admission.start()
+    if LOOP_WATCHDOG:
+        loop_watchdog.start()
 
 
 # =========================
@@ -763,11 +2212,17 @@ async def join_cmd(interaction: discord.Interaction):
     if not interaction.user.voice or not interaction.user.voice.channel:
         return await interaction.response.send_message("먼저 음성 채널에 들어가 주세요.", ephemeral=True)
 
+    await interaction.response.defer(ephemeral=True)
     player = get_player(interaction.guild)
+    new_session = not (player.voice and player.voice.is_connected())
+    rejected = await admission.admit("join", interaction.guild.id, new_session)
+    if rejected:
+        return await interaction.followup.send(rejected, ephemeral=True)
+
     await player.connect_to(interaction.user.voice.channel)
     player.text_channel = interaction.channel  # type: ignore[assignment]
     await player.ensure_task()
-    await interaction.response.send_message(
+    await interaction.followup.send(
         f"✅ {interaction.user.voice.channel.name} 에 연결되었습니다.",
         ephemeral=True,
     )
@@ -790,14 +2245,23 @@ async def play_cmd(interaction: discord.Interaction, query: str):
         return await interaction.followup.send("먼저 음성 채널에 들어가 주세요.", ephemeral=True)
 
     player = get_player(interaction.guild)
+    rejected = await admission.admit("play", interaction.guild.id, new_session=player.source is None)
+    if rejected:
+        return await interaction.followup.send(rejected, ephemeral=True)
     if not player.voice or not player.voice.is_connected():
         await player.connect_to(interaction.user.voice.channel)
 
     player.text_channel = interaction.channel  # type: ignore[assignment]
 
-    track = await ytdlp_extract(query, requester=interaction.user.display_name)
+    track = await ytdlp_extract(
+        query,
+        requester=interaction.user.display_name,
+        fmt=select_quality(player).format,
+    )
     if not track:
         return await interaction.followup.send("트랙을 찾지 못했어요.", ephemeral=True)
+    if player.is_duplicate(track.key):
+        return await interaction.followup.send("이미 대기열에 있는 곡이에요.", ephemeral=True)
 
     # ▶ 재생 중인지 여부 판단
     was_idle = (not player.current) and (not player.queue) and (
@@ -861,25 +2325,202 @@ async def stop_cmd(interaction: discord.Interaction):
 async def queue_cmd(interaction: discord.Interaction):
     player = get_player(interaction.guild)
 
-    lines = []
+    lines = ["**재생목록**"]
     if player.current:
         pos = format_duration(player.get_position())
         dur = format_duration(player.current.duration)
         lines.append(f"**지금 재생 중:** {player.current.title}  `{pos} / {dur}`")
+    lines.append(f"셔플: {'ON' if player.shuffle else 'OFF'} / 반복: {player.loop_mode}")
+
+    view = TrackPageView(player, "queue")
+    await interaction.response.send_message(
+        "\n".join(lines),
+        embed=view.render(),
+        view=view,
+        ephemeral=True,
+    )
+
+
+@bot.tree.command(name="같이듣기", description="같은 그룹에서 같은 곡을 재생하면 음원 하나를 공유합니다.")
+@app_commands.describe(group="같이듣기 그룹 이름 (비우면 해제)")
+async def broadcast_cmd(interaction: discord.Interaction, group: str = ""):
+    player = get_player(interaction.guild)
+    group = group.strip()
+    player.broadcast_group = group or None
+    if group:
+        msg = f"📡 같이듣기 그룹 `{group}` 에 참여했어요. 다음 곡부터 적용됩니다."
+    else:
+        msg = "📡 같이듣기를 해제했어요."
+    await interaction.response.send_message(msg, ephemeral=True)
+
+
+@bot.tree.command(name="음질", description="음질 프로필을 설정합니다. (자동은 채널 비트레이트/서버 부하 기준)")
+@app_commands.describe(mode="자동 / 낮음 / 보통 / 높음")
+@app_commands.choices(
+    mode=[
+        app_commands.Choice(name="자동", value="auto"),
+        app_commands.Choice(name="낮음", value="low"),
+        app_commands.Choice(name="보통", value="medium"),
+        app_commands.Choice(name="높음", value="high"),
+    ]
+)
+async def quality_cmd(interaction: discord.Interaction, mode: app_commands.Choice[str]):
+    player = get_player(interaction.guild)
+    player.quality = mode.value  # type: ignore[assignment]
+    profile = select_quality(player)
+    await interaction.response.send_message(
+        f"🎚️ 음질: {mode.name} (현재 적용: {profile.name}, {profile.bitrate}kbps) — 다음 곡부터 적용됩니다.",
+        ephemeral=True,
+    )
+
+
+@bot.tree.command(name="목록저장", description="현재 재생/대기 목록을 플레이리스트로 저장합니다.")
+@app_commands.describe(name="플레이리스트 이름", scope="서버 공용 / 개인")
+@app_commands.choices(
+    scope=[
+        app_commands.Choice(name="서버", value="guild"),
+        app_commands.Choice(name="개인", value="user"),
+    ]
+)
+async def playlist_save_cmd(interaction: discord.Interaction, name: str, scope: app_commands.Choice[str]):
+    player = get_player(interaction.guild)
+    tracks = ([player.current] if player.current else []) + list(player.queue)
+    if not tracks:
+        return await interaction.response.send_message("저장할 곡이 없습니다.", ephemeral=True)
+
+    owner_id = interaction.guild.id if scope.value == "guild" else interaction.user.id
+    count = save_playlist(scope.value, owner_id, name, tracks)  # type: ignore[arg-type]
+    await interaction.response.send_message(f"💾 `{name}` ({scope.name}) 에 {count}곡 저장했어요.", ephemeral=True)
+
+
+@bot.tree.command(name="목록불러오기", description="저장한 플레이리스트를 대기열에 추가합니다.")
+@app_commands.describe(name="플레이리스트 이름", scope="서버 공용 / 개인")
+@app_commands.choices(
+    scope=[
+        app_commands.Choice(name="서버", value="guild"),
+        app_commands.Choice(name="개인", value="user"),
+    ]
+)
+async def playlist_load_cmd(interaction: discord.Interaction, name: str, scope: app_commands.Choice[str]):
+    if not interaction.user.voice or not interaction.user.voice.channel:
+        return await interaction.response.send_message("먼저 음성 채널에 들어가 주세요.", ephemeral=True)
+
+    owner_id = interaction.guild.id if scope.value == "guild" else interaction.user.id
+    saved = load_playlists(scope.value, owner_id)  # type: ignore[arg-type]
+    if name not in saved:
+        names = ", ".join(saved) or "없음"
+        return await interaction.response.send_message(
+            f"`{name}` 플레이리스트가 없어요. (저장된 목록: {names})",
+            ephemeral=True,
+        )
+
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    player = get_player(interaction.guild)
+    rejected = await admission.admit("play", interaction.guild.id, new_session=player.source is None)
+    if rejected:
+        return await interaction.followup.send(rejected, ephemeral=True)
+    if not player.voice or not player.voice.is_connected():
+        await player.connect_to(interaction.user.voice.channel)
+    player.text_channel = interaction.channel  # type: ignore[assignment]
 
-    if player.queue:
-        for i, t in enumerate(list(player.queue)[:20], start=1):
-            lines.append(f"{i}. {t.title} — 요청자: {t.requester}")
+    was_idle = player.current is None
+    stubs = playlist_stubs(saved[name], interaction.user.display_name)
+    if player.no_duplicates:
+        seen = set()
+        unique = []
+        for t in stubs:
+            if t.key not in seen and not player.is_duplicate(t.key):
+                seen.add(t.key)
+                unique.append(t)
+        stubs = unique
+    player.queue.extend(stubs)
+    await player.ensure_task()
+    if was_idle:
+        player.play_next.set()
     else:
-        lines.append("대기열이 비었습니다.")
+        player.prefetch_next()
+
+    await interaction.followup.send(f"📂 `{name}` 에서 {len(stubs)}곡을 대기열에 추가했어요.", ephemeral=True)
+
+
+@bot.tree.command(name="중복차단", description="이미 재생/대기 중인 곡을 다시 추가하지 못하게 합니다.")
+async def dedupe_cmd(interaction: discord.Interaction):
+    player = get_player(interaction.guild)
+    player.no_duplicates = not player.no_duplicates
+    await interaction.response.send_message(
+        f"🚫 중복 곡 차단 {'ON' if player.no_duplicates else 'OFF'}",
+        ephemeral=True,
+    )
+
+
+@bot.tree.command(name="재생상태", description="재생 위치/시계 오차 등 현재 스트림 상태를 보여줍니다.")
+async def playback_status_cmd(interaction: discord.Interaction):
+    player = get_player(interaction.guild)
+    if not player.current:
+        return await interaction.response.send_message("현재 재생 중인 곡이 없습니다.", ephemeral=True)
+
+    lines = [f"위치: `{format_duration(player.get_position())} / {format_duration(player.current.duration)}`"]
+    drift = player.clock_drift()
+    if drift is not None:
+        lines.append(f"벽시계 대비 오차: `{drift:+.2f}s`")
+    source = player.source
+    if isinstance(source, MonitoredSource):
+        lines.append(
+            f"프레임: {source.frames} • 수신: {source.bytes_read // 1024}KB • 자동 전환: {source.failovers}회"
+        )
+    elif isinstance(source, BroadcastSubscriber):
+        lines.append(f"같이듣기 참여 지점: `{format_duration(source.join_offset)}`")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
 
-    status = f"셔플: {'ON' if player.shuffle else 'OFF'} / 반복: {player.loop_mode}"
+@bot.tree.command(name="자동재생", description="대기열이 비면 비슷한 곡을 이어서 재생합니다.")
+async def autoplay_cmd(interaction: discord.Interaction):
+    player = get_player(interaction.guild)
+    player.autoplay = not player.autoplay
+    guild_settings.set(interaction.guild.id, "autoplay", player.autoplay)
+    if player.autoplay:
+        player.schedule_autoplay_fill()
+        if player.current is None and not player.queue and player.voice and player.voice.is_connected():
+            await player.ensure_task()
+            player.play_next.set()
+    else:
+        player.autoplay_buffer.clear()
     await interaction.response.send_message(
-        "**재생목록**\n" + "\n".join(lines) + f"\n\n{status}",
+        f"📻 자동재생 {'ON' if player.autoplay else 'OFF'}",
         ephemeral=True,
     )
 
 
+@bot.tree.command(name="부하", description="봇의 현재 부하 지표와 요청 거절 통계를 보여줍니다.")
+async def load_cmd(interaction: discord.Interaction):
+    load = host_load()
+    lines = [
+        f"이벤트 루프 지연: `{admission.loop_lag * 1000:.0f}ms` (기준 {ADMIT_MAX_LOOP_LAG * 1000:.0f}ms)",
+        f"추출 대기: `{admission.executor_pending}` (기준 {ADMIT_MAX_EXECUTOR_BACKLOG})",
+        f"FFmpeg 프로세스: `{admission.ffmpeg_count()}` (기준 {ADMIT_MAX_FFMPEG})",
+        f"CPU 부하: `{'알 수 없음' if load is None else f'{load:.2f}'}` (기준 {ADMIT_MAX_LOAD})",
+    ]
+    for kind, counts in admission.stats.items():
+        lines.append(
+            f"{kind}: 수락 {counts['admitted']} / 대기 {counts['deferred']} / 거절 {counts['rejected']}"
+        )
+    if admission.shed_reasons:
+        reasons = ", ".join(f"{SHED_REASON_TEXT[r]} {n}" for r, n in admission.shed_reasons.items())
+        lines.append(f"거절 사유: {reasons}")
+    # 스트림 호스트별 FFmpeg 실패 통계 (문제가 많은 호스트부터)
+    hosts = sorted(
+        source_metrics.items(),
+        key=lambda kv: kv[1]["failures"] + kv[1]["stalls"],
+        reverse=True,
+    )[:SOURCE_METRICS_SHOWN]
+    for host, counts in hosts:
+        lines.append(
+            f"`{host}`: 재생 {counts['plays']} / 실패 {counts['failures']} / "
+            f"멈춤 {counts['stalls']} / 전환 {counts['failovers']}"
+        )
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+
 @bot.tree.command(name="노래랜덤", description="셔플 재생을 켜거나 끕니다.")
 async def shuffle_cmd(interaction: discord.Interaction):
     player = get_player(interaction.guild)
@@ -905,24 +2546,31 @@ async def repeat_cmd(interaction: discord.Interaction, mode: app_commands.Choice
     await interaction.response.send_message(f"🔁 반복 모드: {readable}", ephemeral=True)
 
 
-@bot.tree.command(name="구간이동", description="현재 곡에서 지정한 시각으로 이동합니다. (예: 1:23 또는 0:01:23)")
-@app_commands.describe(timestamp="이동할 시각 (예: 1:23 또는 0:01:23)")
+@bot.tree.command(name="구간이동", description="현재 곡에서 지정한 시각으로 이동합니다. (예: 1:23, 0:01:23, +10, -0:30)")
+@app_commands.describe(timestamp="이동할 시각 (예: 1:23 또는 0:01:23, 앞에 +/- 를 붙이면 현재 위치 기준)")
 async def seek_cmd(interaction: discord.Interaction, timestamp: str):
     player = get_player(interaction.guild)
     if not player.current:
         return await interaction.response.send_message("현재 재생 중인 곡이 없습니다.", ephemeral=True)
 
     try:
-        offset = parse_timestamp(timestamp)
+        ts = timestamp.strip()
+        if ts[:1] in ("+", "-"):
+            delta = parse_timestamp(ts[1:])
+            offset = player.get_position() + (delta if ts[0] == "+" else -delta)
+        else:
+            offset = parse_timestamp(ts)
     except Exception:
         return await interaction.response.send_message("형식이 잘못되었습니다. 예) 1:23 또는 0:01:23", ephemeral=True)
 
+    duration = player.current.duration
+    offset = max(0.0, min(offset, duration - 1)) if duration else max(0.0, offset)
     track = player.current
     track.start_offset = offset
     player.enqueue_front(track)
     if player.voice and (player.voice.is_playing() or player.voice.is_paused()):
         player.voice.stop()
-    await interaction.response.send_message(f"⏩ {timestamp} 시각으로 이동합니다.", ephemeral=True)
+    await interaction.response.send_message(f"⏩ {format_duration(offset)} 시각으로 이동합니다.", ephemeral=True)
 
 
 def parse_timestamp(ts: str) -> float:
@@ -939,43 +2587,297 @@ def parse_timestamp(ts: str) -> float:
     raise ValueError("잘못된 시각 형식입니다. 예) 1:23 또는 0:01:23")
 
 
+# =========================
+# 메시지 청소 엔진
+# =========================
+
+CLEANUP_MAX = 5000
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)  # 여유를 두고 14일 미만만 일괄 삭제
+BULK_BATCH_DELAY = 1.0
+SINGLE_DELETE_DELAY = 1.2  # 14일 지난 메시지는 한 개씩, 천천히
+PROGRESS_INTERVAL = 3.0
+
+# 채널 ID -> 진행 중인 청소 작업 (채널당 하나만)
+cleanup_tasks: dict[int, asyncio.Task] = {}
+
+
+async def cleanup_messages(
+    channel: discord.TextChannel,
+    limit: int,
+    check: Callable[[discord.Message], bool],
+    on_progress: Callable[[int, int], Awaitable[None]],
+    scan_limit: Optional[int] = None,
+) -> tuple[int, int]:
+    """채널 기록을 최신순으로 훑으며 조건에 맞는 메시지를 지운다. (삭제 수, 훑은 수) 반환.
+
+    14일 이내 메시지는 100개씩 일괄 삭제, 그보다 오래된 메시지는 개별 삭제한다.
+    """
+    cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+    batch: List[discord.Message] = []
+    deleted = 0
+    scanned = 0
+    matched = 0
+    last_report = time.monotonic()
+
+    async def report(force: bool = False):
+        nonlocal last_report
+        now = time.monotonic()
+        if force or now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            await on_progress(deleted, scanned)
+
+    async def flush():
+        nonlocal deleted
+        if not batch:
+            return
+        try:
+            await channel.delete_messages(batch)
+            deleted += len(batch)
+        except discord.NotFound:
+            pass
+        batch.clear()
+        await report()
+        await asyncio.sleep(BULK_BATCH_DELAY)
+
+    try:
+        async for msg in channel.history(limit=scan_limit or limit * 5):
+            scanned += 1
+            if msg.pinned or not check(msg):
+                continue
+            matched += 1
+
+            if msg.created_at > cutoff:
+                batch.append(msg)
+                if len(batch) >= 100:
+                    await flush()
+            else:
+                # 기록은 최신순이므로 여기부터는 모두 오래된 메시지
+                await flush()
+                try:
+                    await msg.delete()
+                    deleted += 1
+                except discord.NotFound:
+                    pass
+                await report()
+                await asyncio.sleep(SINGLE_DELETE_DELAY)
+
+            if matched >= limit:
+                break
+
+        await flush()
+    except Exception:
+        # 중간에 실패해도 그때까지 지운 수는 호출자에게 알려 준다
+        await report(force=True)
+        raise
+    return deleted, scanned
+
+
 @bot.tree.command(name="청소", description="이 채널의 최근 메시지를 삭제합니다.")
 @app_commands.checks.has_permissions(manage_messages=True)
-@app_commands.describe(count="삭제할 메시지 개수 (최대 100)")
-async def purge_cmd(interaction: discord.Interaction, count: int = 20):
+@app_commands.describe(
+    count=f"삭제할 메시지 개수 (최대 {CLEANUP_MAX})",
+    bots_only="봇 메시지만 삭제",
+    author="이 사용자의 메시지만 삭제",
+    contains="이 문구가 포함된 메시지만 삭제",
+)
+async def purge_cmd(
+    interaction: discord.Interaction,
+    count: int = 20,
+    bots_only: bool = False,
+    author: Optional[discord.User] = None,
+    contains: Optional[str] = None,
+):
+    channel = interaction.channel
+    running = cleanup_tasks.get(channel.id)
+    if running and not running.done():
+        return await interaction.response.send_message("이 채널에서 이미 청소가 진행 중입니다.", ephemeral=True)
+
     await interaction.response.defer(ephemeral=True, thinking=True)
-    limit = max(1, min(count, 100))
-    deleted = await interaction.channel.purge(limit=limit)  # type: ignore[arg-type]
-    await interaction.followup.send(f"🧹 {len(deleted)}개 메시지 삭제", ephemeral=True)
+    limit = max(1, min(count, CLEANUP_MAX))
+    needle = contains.lower() if contains else None
+
+    def check(msg: discord.Message) -> bool:
+        if bots_only and not msg.author.bot:
+            return False
+        if author and msg.author.id != author.id:
+            return False
+        if needle and needle not in msg.content.lower():
+            return False
+        return True
+
+    done = 0
+
+    async def on_progress(deleted: int, scanned: int):
+        nonlocal done
+        done = deleted
+        try:
+            await interaction.edit_original_response(content=f"🧹 진행 중… {deleted}개 삭제 / {scanned}개 확인")
+        except discord.HTTPException:
+            pass
+
+    async def run():
+        try:
+            deleted, _ = await cleanup_messages(channel, limit, check, on_progress)  # type: ignore[arg-type]
+            msg = f"🧹 {deleted}개 메시지 삭제"
+        except discord.Forbidden:
+            msg = f"메시지를 삭제할 권한이 없습니다. ({done}개 삭제 후 중단)"
+        except Exception as e:
+            log.exception("cleanup failed", extra={"channel_id": channel.id})
+            msg = f"청소 중 오류로 중단했습니다: {e} ({done}개 삭제됨)"
+        finally:
+            if cleanup_tasks.get(channel.id) is asyncio.current_task():
+                del cleanup_tasks[channel.id]
+        try:
+            await interaction.edit_original_response(content=msg)
+        except discord.HTTPException:
+            pass
+
+    cleanup_tasks[channel.id] = asyncio.create_task(run())
+
+
+# =========================
+# TTS 문구 뱅크 / 일괄 합성
+# =========================
+
+# .env 예) TTS_PHRASES=곧 시작합니다|잠시 후 다시 올게요   TTS_PHRASE_VOICES=ko-KR-SunHiNeural,ko-KR-InJoonNeural
+TTS_PHRASES = [p.strip() for p in os.getenv("TTS_PHRASES", "").split("|") if p.strip()]
+TTS_PHRASE_VOICES = [v.strip() for v in os.getenv("TTS_PHRASE_VOICES", TTS_DEFAULT_VOICE).split(",") if v.strip()]
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "enehwl_tts"))
+TTS_BATCH_WINDOW = 0.4  # 이 시간 안에 들어온 요청은 한 번에 합성
+
+
+async def synthesize_tts(text: str, voice: str, out_path: str):
+    comm = edge_tts.Communicate(text, voice=voice, rate="+0%", volume="+0%")
+    await comm.save(out_path)
+
+
+class PhraseBank:
+    """자주 쓰는 문구를 미리 합성해 두고 디스크에 보관한다 (재시작 후에도 재사용)."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._paths: dict[tuple[str, str], str] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def _path_for(self, text: str, voice: str) -> str:
+        digest = hashlib.sha1(f"{voice}\n{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.mp3")
+
+    def get(self, text: str, voice: str) -> Optional[str]:
+        return self._paths.get((text.strip(), voice))
+
+    async def warm(self, phrases: List[str], voices: List[str]):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 연결을 한꺼번에 열지 않도록 순서대로 합성
+        for voice in voices:
+            for text in phrases:
+                path = self._path_for(text, voice)
+                if not os.path.exists(path):
+                    tmp = path + ".part"
+                    try:
+                        await synthesize_tts(text, voice, tmp)
+                        os.replace(tmp, path)
+                    except Exception:
+                        log.warning("TTS 문구 합성 실패", exc_info=True, extra={"voice": voice})
+                        continue
+                self._paths[(text, voice)] = path
+
+    def start(self):
+        if TTS_PHRASES and (self.task is None or self.task.done()) and not self._paths:
+            self.task = asyncio.create_task(self.warm(TTS_PHRASES, TTS_PHRASE_VOICES))
+
+
+@dataclass
+class _TTSBatch:
+    texts: List[str] = field(default_factory=list)
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    task: Optional[asyncio.Task] = None  # _flush 작업 (GC 로 사라지지 않게 참조 유지)
+
+
+class TTSBatcher:
+    """짧은 시간 안에 들어온 같은 길드/목소리의 요청을 edge-tts 한 번으로 합친다."""
+
+    def __init__(self, window: float = TTS_BATCH_WINDOW):
+        self.window = window
+        self._pending: dict[tuple[int, str], _TTSBatch] = {}
+
+    async def submit(self, guild_id: int, voice: str, text: str) -> tuple[str, List[str], bool]:
+        """(mp3 경로, 합쳐진 문장들, 대표 요청 여부) 반환. 대표 요청만 대기열에 추가한다."""
+        key = (guild_id, voice)
+        batch = self._pending.get(key)
+        leader = batch is None
+        if leader:
+            batch = _TTSBatch()
+            self._pending[key] = batch
+            batch.task = asyncio.create_task(self._flush(key, batch, voice))
+        batch.texts.append(text)
+        path = await asyncio.shield(batch.future)
+        return path, batch.texts, leader
+
+    async def _flush(self, key: tuple[int, str], batch: _TTSBatch, voice: str):
+        await asyncio.sleep(self.window)
+        self._pending.pop(key, None)
+        out_path = None
+        try:
+            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as f:
+                out_path = f.name
+            await synthesize_tts("\n".join(batch.texts), voice, out_path)
+            batch.future.set_result(out_path)
+        except Exception as e:
+            if out_path:
+                try:
+                    os.remove(out_path)
+                except OSError:
+                    pass
+            batch.future.set_exception(e)
+
+
+phrase_bank = PhraseBank(TTS_CACHE_DIR)
+tts_batcher = TTSBatcher()
 
 
 @bot.tree.command(name="dots", description="텍스트를 음성으로 읽어줍니다.")
-@app_commands.describe(text="읽어줄 텍스트", voice="예: ko-KR-SunHiNeural")
-async def dots_cmd(interaction: discord.Interaction, text: str, voice: str = "ko-KR-SunHiNeural"):
+@app_commands.describe(text="읽어줄 텍스트", voice=f"예: {TTS_DEFAULT_VOICE} (비우면 서버 설정)")
+async def dots_cmd(interaction: discord.Interaction, text: str, voice: Optional[str] = None):
     await interaction.response.defer(thinking=True, ephemeral=True)
     if not interaction.user.voice or not interaction.user.voice.channel:
         return await interaction.followup.send("먼저 음성 채널에 들어가 주세요.", ephemeral=True)
 
     player = get_player(interaction.guild)
+    voice = voice or player.setting("tts_voice")
+    rejected = await admission.admit("tts", interaction.guild.id, new_session=player.source is None)
+    if rejected:
+        return await interaction.followup.send(rejected, ephemeral=True)
     if not player.voice or not player.voice.is_connected():
         await player.connect_to(interaction.user.voice.channel)
 
     player.text_channel = interaction.channel  # type: ignore[assignment]
 
     try:
-        with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as f:
-            out_path = f.name
-
-        comm = edge_tts.Communicate(text, voice=voice, rate="+0%", volume="+0%")
-        await comm.save(out_path)
+        # ▶ 미리 합성해 둔 문구면 바로 재생 (파일은 지우지 않음)
+        out_path = phrase_bank.get(text, voice)
+        temp_path = None
+        texts = [text]
+        if out_path is None:
+            out_path, texts, leader = await tts_batcher.submit(interaction.guild.id, voice, text)
+            if not leader:
+                return await interaction.followup.send(
+                    f"🗣️ 직전 TTS 요청과 합쳐서 읽어요 ({voice})",
+                    ephemeral=True,
+                )
+            temp_path = out_path
 
+        joined = " / ".join(texts)
         tts_track = Track(
-            title=f"TTS: {text[:24]}{'...' if len(text) > 24 else ''}",
-            stream_url=out_path,
-            page_url="tts://local",
+            meta=TrackMeta(
+                key=f"local:{out_path}",
+                title=f"TTS: {joined[:24]}{'...' if len(joined) > 24 else ''}",
+                page_url="tts://local",
+                stream_url=out_path,
+            ),
             requester=interaction.user.display_name,
             is_local_file=True,
-            temp_path=out_path,
+            temp_path=temp_path,
         )
 
         # ▶ 추가: 현재 재생 여부 확인
@@ -989,6 +2891,7 @@ async def dots_cmd(interaction: discord.Interaction, text: str, voice: str = "ko
 
         await interaction.followup.send(f"🗣️ TTS 대기열 추가 ({voice})", ephemeral=True)
     except Exception as e:
+        player.log.exception("TTS failed", extra={"voice": voice})
         await interaction.followup.send(f"TTS 오류: {e}", ephemeral=True)
 
 
@@ -1002,10 +2905,112 @@ async def purge_error(interaction: discord.Interaction, error: app_commands.AppC
     raise error
 
 
+@bot.tree.command(name="설정", description="(관리자) 이 서버의 봇 설정을 보거나 바꿉니다.")
+@app_commands.checks.has_permissions(manage_guild=True)
+@app_commands.describe(key="바꿀 설정 (비우면 전체 보기)", value="새 값 (비우면 현재 값, '기본' 이면 기본값으로)")
+@app_commands.choices(
+    key=[app_commands.Choice(name=spec.label, value=name) for name, spec in SETTING_SPECS.items()]
+)
+async def settings_cmd(
+    interaction: discord.Interaction,
+    key: Optional[app_commands.Choice[str]] = None,
+    value: Optional[str] = None,
+):
+    guild_id = interaction.guild.id
+    if key is None:
+        lines = [
+            f"`{name}` {SETTING_SPECS[name].label}: **{v}**"
+            for name, v in guild_settings.all(guild_id).items()
+        ]
+        return await interaction.response.send_message("⚙️ 서버 설정\n" + "\n".join(lines), ephemeral=True)
+
+    name = key.value
+    if value is None:
+        current = guild_settings.get(guild_id, name)
+        return await interaction.response.send_message(f"⚙️ {key.name}: **{current}**", ephemeral=True)
+
+    if value.strip() in ("기본", "default"):
+        guild_settings.reset(guild_id, name)
+        new_value = SETTING_SPECS[name].default
+    else:
+        try:
+            new_value = guild_settings.set_raw(guild_id, name, value)
+        except ValueError as e:
+            return await interaction.response.send_message(f"값이 올바르지 않아요: {e}", ephemeral=True)
+
+    # 실행 중인 플레이어에 바로 반영되는 값
+    player = players.get(guild_id)
+    if player and name == "autoplay":
+        player.autoplay = new_value
+    await interaction.response.send_message(f"⚙️ {key.name} → **{new_value}**", ephemeral=True)
+
+
+@settings_cmd.error
+async def settings_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.errors.MissingPermissions):
+        return await interaction.response.send_message(
+            "이 명령을 사용할 권한이 없습니다. (manage_guild 필요)",
+            ephemeral=True,
+        )
+    raise error
+
+
+@bot.tree.command(name="프로파일", description="(관리자) 이벤트 루프 지연 감시와 느린 콜백 통계를 봅니다.")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(action="켜기 / 끄기 / 보기 / 초기화")
+@app_commands.choices(
+    action=[
+        app_commands.Choice(name="켜기", value="start"),
+        app_commands.Choice(name="끄기", value="stop"),
+        app_commands.Choice(name="보기", value="show"),
+        app_commands.Choice(name="초기화", value="reset"),
+    ]
+)
+async def profile_cmd(interaction: discord.Interaction, action: app_commands.Choice[str]):
+    wd = loop_watchdog
+    if action.value == "start":
+        wd.start()
+        return await interaction.response.send_message(
+            f"🩺 루프 감시 시작 (기준 {wd.threshold * 1000:.0f}ms)", ephemeral=True
+        )
+    if action.value == "stop":
+        wd.stop()
+        return await interaction.response.send_message("🩺 루프 감시 중지", ephemeral=True)
+    if action.value == "reset":
+        wd.reset()
+        return await interaction.response.send_message("🩺 통계를 초기화했어요.", ephemeral=True)
+
+    lines = [
+        f"감시: {'ON' if wd.running else 'OFF'} • 최대 지연 `{wd.max_lag * 1000:.0f}ms` • 기록된 멈춤 {wd.stalls}회"
+    ]
+    offenders = wd.worst_offenders()
+    for i, e in enumerate(offenders, start=1):
+        lines.append(
+            f"`{i}.` **{e.name}** — {e.count}회, 최대 {e.worst * 1000:.0f}ms, 합계 {e.total * 1000:.0f}ms"
+        )
+    if offenders:
+        stack = "".join(offenders[0].stack)[-1200:]
+        lines.append(f"가장 큰 원인의 스택:\n```\n{stack}```")
+    elif wd.running:
+        lines.append("아직 기준을 넘은 멈춤이 없어요.")
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+
+@profile_cmd.error
+async def profile_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.errors.MissingPermissions):
+        return await interaction.response.send_message(
+            "이 명령을 사용할 권한이 없습니다. (administrator 필요)",
+            ephemeral=True,
+        )
+    raise error
+
+
 # =========================
 # 진입점
 # =========================
 if __name__ == "__main__":
     if not TOKEN:
         raise RuntimeError("환경변수 DISCORD_TOKEN 이 비었습니다 (.env 설정 필요)")
-    bot.run(TOKEN)
+    # discord.py 기본 핸들러 대신 위의 큐 기반 루트 로거를 사용
+    bot.run(TOKEN, log_handler=None)